@@ -1,5 +1,185 @@
 """base methods and classes
+
+instrumentation
+
+  - every BaseHandler can record timing spans, counters and histograms into the process wide METRICS registry
+    - with self.span('name'): ... records span_duration_ms{handler, span} and counts span_errors_total on exceptions
+    - @instrumented('name') wraps a method, or coroutine method, in a span
+    - self.metric_count(name, value, **labels) and self.metric_observe(name, value, **labels)
+  - disabled by default, a disabled hook is a flag check, enable with instrumentation_enable()
+    or the environment variable AGENT_METRICS=1
+  - METRICS.prometheus_text() and METRICS.json_lines() export the recorded metrics
 """
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+
+HISTOGRAM_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+METRICS_ENV = 'AGENT_METRICS'
+SPAN_HISTOGRAM = 'span_duration_ms'
+SPAN_ERRORS = 'span_errors_total'
+
+
+class Metrics():
+    """Thread-safe registry of counters and histograms, keyed by metric name and sorted label pairs."""
+
+    def __init__(self, enabled=False, buckets=HISTOGRAM_BUCKETS_MS):
+        self.enabled: bool = enabled
+        self.buckets: tuple = tuple(buckets)
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = histogram
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: {**h, 'buckets': list(h['buckets'])} for key, h in self.histograms.items()}
+            }
+
+    def prometheus_text(self) -> str:
+        """Metrics in the Prometheus text exposition format, histogram buckets are cumulative."""
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{_label_text(labels)} {value}')
+        for (name, labels), histogram in sorted(snapshot['histograms'].items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(self.buckets, histogram['buckets']):
+                cumulative += n
+                lines.append(f'{name}_bucket{_label_text(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_label_text(labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{name}_sum{_label_text(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_count{_label_text(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def json_lines(self) -> str:
+        """One JSON object per metric series, {"name", "type", "labels", "value"} or histogram fields."""
+        snapshot = self.snapshot()
+        records = [
+            {'name': name, 'type': 'counter', 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(snapshot['counters'].items())
+        ]
+        records.extend(
+            {
+                'name': name,
+                'type': 'histogram',
+                'labels': dict(labels),
+                'buckets': dict(zip([str(b) for b in self.buckets], histogram['buckets'])),
+                'sum': histogram['sum'],
+                'count': histogram['count']
+            }
+            for (name, labels), histogram in sorted(snapshot['histograms'].items())
+        )
+        return ''.join(json.dumps(r) + '\n' for r in records)
+
+
+class _Span():
+    __slots__ = ('handler', 'name', 'start')
+
+    def __init__(self, handler: str, name: str):
+        self.handler = handler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        METRICS.observe(SPAN_HISTOGRAM, elapsed_ms, handler=self.handler, span=self.name)
+        if exc_type is not None:
+            METRICS.count(SPAN_ERRORS, handler=self.handler, span=self.name)
+        return False
+
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+METRICS = Metrics(enabled=os.environ.get(METRICS_ENV, '') not in ('', '0'))
+
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def instrumentation_enable(enabled=True):
+    METRICS.enabled = enabled
+
+
+def instrumented(span_name: str):
+    """Decorator that records each call of a handler method as a span, a flag check while disabled."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if not METRICS.enabled:
+                    return await func(self, *args, **kwargs)
+                with _Span(self.__class__.__name__, span_name):
+                    return await func(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not METRICS.enabled:
+                return func(self, *args, **kwargs)
+            with _Span(self.__class__.__name__, span_name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class BaseHandler():
     def __init__(self):
         self._status_code: int = 0
@@ -13,6 +193,19 @@ class BaseHandler():
         else:
             return 'ERROR'
 
+    def span(self, name: str):
+        if not METRICS.enabled:
+            return _NULL_SPAN
+        return _Span(self.__class__.__name__, name)
+
+    def metric_count(self, name: str, value=1, **labels):
+        if METRICS.enabled:
+            METRICS.count(name, value, handler=self.__class__.__name__, **labels)
+
+    def metric_observe(self, name: str, value: float, **labels):
+        if METRICS.enabled:
+            METRICS.observe(name, value, handler=self.__class__.__name__, **labels)
+
     def _exception_handle(self, msg='', exception=None, is_fatal=True, re_raise=False):
         ex_msg = f'ERROR. {msg} {exception}'
         self.error = ex_msg
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""build time benchmark for DBConnector.build()
+
+  - builds a fresh database in a temporary directory, repeat times
+    - full: build(force=True), every table dropped, created and loaded from the CSV files
+    - incremental: build() with unchanged inputs, only the build_meta hashes are checked
+    {
+        "full": <latency_summary() of the build times, see timing.py>,
+        "incremental": <latency_summary()>
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import os
+import tempfile
+from recommend_agent.roaming_plans import DBConnector
+from .timing import latency_summary, time_call
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+REPEAT_DEFAULT = 5
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def build_benchmark(repeat=REPEAT_DEFAULT) -> dict:
+    full, incremental = [], []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DBConnector(db_path=os.path.join(tmp_dir, 'plans.sqlite'))
+        if not db.build():
+            raise RuntimeError(f'benchmark database build failed. {db.error}')
+        for _ in range(repeat):
+            full.append(time_call(db.build, force=True))
+            incremental.append(time_call(db.build))
+        db.close()
+    return {
+        'full': latency_summary(full),
+        'incremental': latency_summary(incremental)
+    }
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""overhead benchmark for RoamingIntentClassifier.classify() with a stub LLM
+
+  - the stub answers every prompt at once with a fixed response, so the timings cover only the
+    local work of a request: pre-filter, prompt compilation, message building and response parsing
+    - llm: destination pre-filter off, every input reaches the stub
+    - prefilter: destination pre-filter on, destination inputs are answered by the gazetteer
+    {
+        "llm": <latency_summary() of the per-call times, see timing.py>,
+        "prefilter": <latency_summary()>
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from recommend_agent.chat_agent import RoamingIntentClassifier
+from .timing import latency_summary, time_call
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+REPEAT_DEFAULT = 20
+STUB_RESPONSE = "Reasoning: canned response.\nScore: 0.9"
+MODES = {
+    'llm': {'destination_prefilter': False},
+    'prefilter': {'destination_prefilter': True}
+}
+PROMPTS = [
+    "I'm going to Japan next week",
+    "heading to KL for 3 days",
+    "what data plan do I need in Bali?",
+    "Can I use my phone overseas?",
+    "I want a pony",
+    "Will I catch a cold if I am out in the rain too long?",
+    "Do I need a sim card for my trip to the Alps?",
+    "backpacking across south east asia for a month"
+]
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class StubLLM:
+    """Stands in for the chat model, answers every prompt immediately with STUB_RESPONSE."""
+
+    def invoke(self, messages, **kwargs):
+        return type('Response', (), {'content': STUB_RESPONSE})()
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def classify_benchmark(repeat=REPEAT_DEFAULT) -> dict:
+    report = {}
+    for mode, kwargs in MODES.items():
+        classifier = RoamingIntentClassifier(llm=StubLLM(), **kwargs)
+        for prompt in PROMPTS:
+            classifier.classify(prompt)
+        samples = [time_call(classifier.classify, prompt) for _ in range(repeat) for prompt in PROMPTS]
+        report[mode] = latency_summary(samples)
+    return report
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""solve time benchmark for RoamingPlanRecommender.optimize_itinerary()
+
+  - builds the roaming plans database if needed and solves seeded random multi-leg trips from the catalog snapshot,
+    repeat times each after one warm-up pass
+    - short: 3 legs of 1 - 7 days
+    - long: 10 legs of 60 days in total
+    {
+        "short": <latency_summary() of the per-solve times, see timing.py>,
+        "long": <latency_summary()>
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import random
+from recommend_agent import roaming_plans
+from recommend_agent.recommend import RoamingPlanRecommender
+from .timing import latency_summary, time_call
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+REPEAT_DEFAULT = 20
+TRIPS = 10
+SEED = 0
+SHAPES = {
+    'short': {'legs': 3, 'days': None},
+    'long': {'legs': 10, 'days': 60}
+}
+DESTINATIONS = ['Malaysia', 'Thailand', 'Indonesia', 'Japan', 'Australia', 'China', 'France', 'Germany',
+                'United States', 'Brazil']
+SERVICE_TYPES = ['data', 'data', 'calls', 'sms']
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def random_legs(rng: random.Random, legs: int, days=None) -> list[dict]:
+    """Random legs, with days set the trip is split into legs of random lengths adding up to days."""
+    if days:
+        cuts = sorted(rng.sample(range(1, days), legs - 1))
+        durations = [b - a for a, b in zip([0] + cuts, cuts + [days])]
+    else:
+        durations = [rng.randint(1, 7) for _ in range(legs)]
+    return [
+        {
+            'destination': rng.choice(DESTINATIONS),
+            'duration_days': duration_days,
+            'service_type': rng.choice(SERVICE_TYPES),
+            'data_needed_gb': round(rng.uniform(0.5, 2.0) * duration_days, 1)
+        }
+        for duration_days in durations
+    ]
+
+
+def itinerary_benchmark(repeat=REPEAT_DEFAULT) -> dict:
+    roaming_plans.db_build()
+    recommender = RoamingPlanRecommender(snapshot=True)
+    rng = random.Random(SEED)
+    report = {}
+    for shape, kwargs in SHAPES.items():
+        trips = [random_legs(rng, **kwargs) for _ in range(TRIPS)]
+        for legs in trips:
+            recommender.optimize_itinerary(legs)
+        samples = [time_call(recommender.optimize_itinerary, legs) for _ in range(repeat) for legs in trips]
+        report[shape] = latency_summary(samples)
+    recommender.exit()
+    return report
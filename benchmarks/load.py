@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""concurrent session load test for DialogueManager and RoamingPlanRecommender
+
+python -m benchmarks.load [--users 1,10,50] [--conversations 4] [--driver threads | async]
+                          [--latency-ms 300] [--distribution fixed | uniform | exponential | lognormal] [--sigma 0.5]
+                          [--snapshot] [--seed 0] [--json]
+
+  - each simulated user runs scripted conversations against one shared DialogueManager and recommender
+    - every turn of the script goes through step(), or astep() with --driver async
+    - once the agent redirects, the user asks recommend() for the trip of the script
+  - the intent classifier calls a local stub LLM, see StubLatencyLLM, no outside service is used
+    - inputs with a travel word are scored relevant, others are not
+    - each LLM response waits a latency drawn from the distribution with mean latency_ms
+      (lognormal uses sigma as the standard deviation of the underlying normal)
+  - reports per users level, --users takes a comma separated list to check how throughput scales
+    {
+        "users": <concurrent users>,
+        "conversations": <conversations completed>,
+        "duration_s": <wall time of the level>,
+        "throughput": {"conversations_per_s", "steps_per_s", "recommends_per_s"},
+        "stages": {
+            <step | recommend | conversation>: {
+                <latency_summary() fields, see timing.py>,
+                "errors": <failed calls>,
+                "error_rate": <failed calls / calls>
+            }
+        }
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from recommend_agent import roaming_plans
+from recommend_agent.chat_agent import DialogueManager
+from recommend_agent.recommend import RoamingPlanRecommender
+from recommend_agent.replay import ReplayLLM
+from .timing import latency_summary
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+USERS_DEFAULT = '1,10,50'
+CONVERSATIONS_DEFAULT = 4
+LATENCY_MS_DEFAULT = 300.0
+DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+DISTRIBUTION_DEFAULT = 'lognormal'
+SIGMA_DEFAULT = 0.5
+DRIVERS = ['threads', 'async']
+STAGES = ['step', 'recommend', 'conversation']
+TRAVEL_WORDS = ['travel', 'trip', 'roaming', 'overseas', 'abroad', 'holiday', 'sim', 'data plan', 'going to']
+RELEVANT_RESPONSE = "Reasoning: the user mentions travel.\nScore: 0.9"
+IRRELEVANT_RESPONSE = "Reasoning: the user does not mention travel.\nScore: 0.1"
+SCRIPTS = [
+    {
+        'turns': ["hello", "can you help me?", "I'm going to Japan for 5 days"],
+        'trip': {'destination': 'Japan', 'duration_days': 5, 'service_type': 'data', 'data_needed_gb': 3.0}
+    },
+    {
+        'turns': ["what's the weather like", "I need a data plan for my holiday"],
+        'trip': {'destination': 'Thailand', 'duration_days': 7, 'service_type': 'data', 'data_needed_gb': 5.0}
+    },
+    {
+        'turns': ["heading to KL next week"],
+        'trip': {'destination': 'Malaysia', 'duration_days': 3, 'service_type': 'calls'}
+    },
+    {
+        'turns': ["I want a pony", "ok then, will my phone work overseas?"],
+        'trip': {'destination': 'France', 'duration_days': 10, 'service_type': 'sms'}
+    },
+    {
+        'turns': ["backpacking trip across Europe for a month"],
+        'trip': {'destination': 'Germany', 'duration_days': 30, 'service_type': 'data', 'data_needed_gb': 10.0}
+    }
+]
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def stub_response(messages) -> str:
+    text = messages[-1].content.lower()
+    return RELEVANT_RESPONSE if any(word in text for word in TRAVEL_WORDS) else IRRELEVANT_RESPONSE
+
+
+def is_error_response(response) -> bool:
+    return isinstance(response, list) and bool(response) and 'error' in response[0]
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class StubLatencyLLM(ReplayLLM):
+    """Scripted stub LLM whose response latency is drawn from a distribution with mean latency_ms."""
+
+    def __init__(self, latency_ms=LATENCY_MS_DEFAULT, distribution=DISTRIBUTION_DEFAULT, sigma=SIGMA_DEFAULT,
+                 seed=None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"unknown distribution '{distribution}', expected one of {', '.join(DISTRIBUTIONS)}")
+        self.latency_ms: float = latency_ms
+        self.distribution: str = distribution
+        self.sigma: float = sigma
+        super().__init__(scripted=stub_response, seed=seed)
+
+    def _delay(self) -> float:
+        mean = self.latency_ms / 1000
+        if mean <= 0:
+            return 0.0
+        with self._lock:
+            if self.distribution == 'uniform':
+                return self._random.uniform(0, 2 * mean)
+            if self.distribution == 'exponential':
+                return self._random.expovariate(1 / mean)
+            if self.distribution == 'lognormal':
+                return self._random.lognormvariate(math.log(mean) - self.sigma ** 2 / 2, self.sigma)
+        return mean
+
+
+class LoadTest:
+    """Shared DialogueManager and recommender for one users level, with per-stage samples and error counts."""
+
+    def __init__(self, llm, snapshot=False):
+        self.manager = DialogueManager(intent_classifier_llm=llm)
+        self.recommender = RoamingPlanRecommender(snapshot=snapshot)
+        self.samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+        self.errors: dict[str, int] = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, start: float, failed=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples[stage].append(elapsed_ms)
+            self.errors[stage] += failed
+
+    def conversation(self, script: dict):
+        conversation_start = time.perf_counter()
+        failed = False
+        for user_input in script['turns']:
+            start = time.perf_counter()
+            try:
+                response = self.manager.step(user_input)
+            except Exception:
+                self.record('step', start, failed=True)
+                failed = True
+                break
+            self.record('step', start)
+            if 'redirect' in response:
+                failed = not self.recommend(script['trip'])
+                break
+        self.record('conversation', conversation_start, failed=failed)
+
+    async def aconversation(self, script: dict):
+        conversation_start = time.perf_counter()
+        session_id = self.manager.session_start()['session_id']
+        failed = False
+        for user_input in script['turns']:
+            start = time.perf_counter()
+            try:
+                response = await self.manager.astep(user_input, session_id=session_id)
+            except Exception:
+                self.record('step', start, failed=True)
+                failed = True
+                break
+            self.record('step', start)
+            if 'redirect' in response:
+                failed = not await asyncio.to_thread(self.recommend, script['trip'])
+                break
+        self.manager.session_end(session_id)
+        self.record('conversation', conversation_start, failed=failed)
+
+    def recommend(self, trip: dict) -> bool:
+        start = time.perf_counter()
+        try:
+            failed = is_error_response(self.recommender.recommend(**trip))
+        except Exception:
+            failed = True
+        self.record('recommend', start, failed=failed)
+        return not failed
+
+    def report(self, users: int, duration_s: float) -> dict:
+        stages = {}
+        for stage in STAGES:
+            calls = len(self.samples[stage])
+            stages[stage] = {
+                **latency_summary(self.samples[stage]),
+                'errors': self.errors[stage],
+                'error_rate': round(self.errors[stage] / calls, 4) if calls else 0.0
+            }
+        return {
+            'users': users,
+            'conversations': len(self.samples['conversation']),
+            'duration_s': round(duration_s, 3),
+            'throughput': {
+                f'{name}_per_s': round(len(self.samples[stage]) / duration_s, 2) if duration_s else 0.0
+                for name, stage in [('conversations', 'conversation'), ('steps', 'step'), ('recommends', 'recommend')]
+            },
+            'stages': stages
+        }
+
+
+def load_test(users: int, conversations=CONVERSATIONS_DEFAULT, driver='threads', latency_ms=LATENCY_MS_DEFAULT,
+              distribution=DISTRIBUTION_DEFAULT, sigma=SIGMA_DEFAULT, snapshot=False, seed=None) -> dict:
+    """Runs users simulated users, each through conversations scripted conversations. Returns the level report."""
+    llm = StubLatencyLLM(latency_ms=latency_ms, distribution=distribution, sigma=sigma, seed=seed)
+    test = LoadTest(llm, snapshot=snapshot)
+    # warm the classifier and recommender so that one-off loading and imports are not timed as load
+    test.manager.step(SCRIPTS[0]['turns'][0])
+    test.recommender.recommend(**SCRIPTS[0]['trip'])
+    scripts = [
+        [SCRIPTS[(u + c) % len(SCRIPTS)] for c in range(conversations)]
+        for u in range(users)
+    ]
+
+    start = time.perf_counter()
+    if driver == 'async':
+        async def user(user_scripts):
+            for script in user_scripts:
+                await test.aconversation(script)
+
+        async def users_run():
+            await asyncio.gather(*(user(s) for s in scripts))
+
+        asyncio.run(users_run())
+    else:
+        def user(user_scripts):
+            for script in user_scripts:
+                test.conversation(script)
+
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            list(executor.map(user, scripts))
+    duration_s = time.perf_counter() - start
+
+    test.recommender.exit()
+    return test.report(users, duration_s)
+
+
+def report_print(report: dict):
+    throughput = report['throughput']
+    print(
+        f"{report['users']:>5} users  {report['conversations']} conversations in {report['duration_s']:.2f} s  "
+        f"{throughput['conversations_per_s']:.1f} conv/s  {throughput['steps_per_s']:.1f} steps/s  "
+        f"{throughput['recommends_per_s']:.1f} recommends/s"
+    )
+    for stage, s in report['stages'].items():
+        print(
+            f"      {stage:<13} p50 {s['p50_ms']:>9.2f} ms  p95 {s['p95_ms']:>9.2f} ms  p99 {s['p99_ms']:>9.2f} ms  "
+            f"errors {s['errors']} ({s['error_rate']:.2%})"
+        )
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def run():
+    parser = argparse.ArgumentParser(description='drive concurrent simulated users through dialogue and recommender')
+    parser.add_argument('--users', default=USERS_DEFAULT, help='comma separated concurrent user levels')
+    parser.add_argument('--conversations', type=int, default=CONVERSATIONS_DEFAULT, help='conversations per user')
+    parser.add_argument('--driver', choices=DRIVERS, default='threads', help='thread per user or one event loop')
+    parser.add_argument('--latency-ms', type=float, default=LATENCY_MS_DEFAULT, help='mean stub LLM latency')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default=DISTRIBUTION_DEFAULT,
+                        help='stub LLM latency distribution')
+    parser.add_argument('--sigma', type=float, default=SIGMA_DEFAULT, help='lognormal shape parameter')
+    parser.add_argument('--snapshot', action='store_true', help='serve recommendations from the catalog snapshot')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the stub LLM latencies')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON')
+    args = parser.parse_args()
+
+    roaming_plans.db_build()
+    reports = [
+        load_test(
+            int(users), conversations=args.conversations, driver=args.driver, latency_ms=args.latency_ms,
+            distribution=args.distribution, sigma=args.sigma, snapshot=args.snapshot, seed=args.seed
+        )
+        for users in args.users.split(',') if users.strip()
+    ]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            report_print(report)
+
+
+if __name__ == '__main__':
+    run()
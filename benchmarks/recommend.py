@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""latency benchmark for RoamingPlanRecommender.recommend()
+
+  - builds the roaming plans database if needed and runs every combination of the workload
+    destinations, durations and service types, repeat times after one warm-up pass
+  - measures each recommend() call in the database, snapshot and compiled catalog modes
+    {
+        "database": <latency_summary() of the per-call times, see timing.py>,
+        "snapshot": <latency_summary()>,
+        "compiled": <latency_summary()>
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from recommend_agent import roaming_plans
+from recommend_agent.compiled import CATALOG_PATH
+from recommend_agent.recommend import RoamingPlanRecommender
+from .timing import latency_summary, time_call
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+REPEAT_DEFAULT = 5
+MODES = {
+    'database': {},
+    'snapshot': {'snapshot': True},
+    'compiled': {'catalog_path': CATALOG_PATH}
+}
+DESTINATIONS = ['Malaysia', 'japan', 'France', 'Thailand', 'United States', 'Australia', 'Brazil', 'Malaysa']
+DURATIONS = [1, 2, 3, 5, 6, 7, 10, 15, 30]
+SERVICE_TYPES = ['data', 'calls', 'sms']
+DATA_NEEDED_GB = 3.0
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def workload() -> list[dict]:
+    return [
+        {
+            'destination': destination,
+            'duration_days': duration_days,
+            'service_type': service_type,
+            'data_needed_gb': DATA_NEEDED_GB
+        }
+        for destination in DESTINATIONS
+        for duration_days in DURATIONS
+        for service_type in SERVICE_TYPES
+    ]
+
+
+def recommend_benchmark(repeat=REPEAT_DEFAULT) -> dict:
+    roaming_plans.db_build(compile_catalog=True)
+    trips = workload()
+    report = {}
+    for mode, kwargs in MODES.items():
+        recommender = RoamingPlanRecommender(**kwargs)
+        for trip in trips:
+            recommender.recommend(**trip)
+        samples = [time_call(recommender.recommend, **trip) for _ in range(repeat) for trip in trips]
+        report[mode] = latency_summary(samples)
+        recommender.exit()
+    return report
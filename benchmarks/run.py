@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""benchmark suite runner
+
+python -m benchmarks.run [--only recommend,itinerary,classify,build,startup] [--repeat N] [--output report.json]
+                         [--compare baseline.json] [--tolerance 0.25] [--min-delta-ms 0.05]
+
+  - runs the selected benchmarks and prints a summary of each timing
+    - recommend: RoamingPlanRecommender.recommend() latency percentiles, see recommend.py
+    - itinerary: RoamingPlanRecommender.optimize_itinerary() solve time for short and 60 day trips, see itinerary.py
+    - classify: RoamingIntentClassifier.classify() overhead with a stub LLM, see classify.py
+    - build: DBConnector.build() full and incremental build times, see build.py
+    - startup: cold import time of cli_agent, see startup.py
+  - --output writes the report as JSON
+    {
+        "created_at": <UTC timestamp>,
+        "python": <interpreter version>,
+        "platform": <platform string>,
+        "benchmarks": {<benchmark>: <benchmark report>, ...}
+    }
+  - --compare checks every *_ms timing except max_ms against a report saved earlier with --output,
+    and exits 1 if any timing is slower than the baseline by more than tolerance and by more than min_delta_ms
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime, timezone
+from .build import build_benchmark
+from .classify import classify_benchmark
+from .itinerary import itinerary_benchmark
+from .recommend import recommend_benchmark
+from .startup import startup_benchmark
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+BENCHMARKS = {
+    'recommend': recommend_benchmark,
+    'itinerary': itinerary_benchmark,
+    'classify': classify_benchmark,
+    'build': build_benchmark,
+    'startup': startup_benchmark
+}
+TOLERANCE_DEFAULT = 0.25
+MIN_DELTA_MS_DEFAULT = 0.05
+TIMING_SUFFIX = '_ms'
+UNCOMPARED_TIMINGS = {'max_ms'}
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def suite_run(names=None, repeat=None) -> dict:
+    kwargs = {'repeat': repeat} if repeat else {}
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': {name: BENCHMARKS[name](**kwargs) for name in names or BENCHMARKS}
+    }
+
+
+def timings(report: dict, prefix='') -> dict[str, float]:
+    """Flattens the *_ms values of nested report dicts to {"benchmark.mode.metric": ms}, lists are skipped."""
+    flat = {}
+    for key, value in report.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(timings(value, prefix=f'{path}.'))
+        elif key.endswith(TIMING_SUFFIX) and isinstance(value, (int, float)):
+            flat[path] = float(value)
+    return flat
+
+
+def regressions(report: dict, baseline: dict, tolerance=TOLERANCE_DEFAULT,
+                min_delta_ms=MIN_DELTA_MS_DEFAULT) -> list[dict]:
+    """Timings present in both reports that are slower than the baseline beyond both thresholds."""
+    current, previous = timings(report['benchmarks']), timings(baseline['benchmarks'])
+    slower = []
+    for path, ms in current.items():
+        baseline_ms = previous.get(path)
+        if baseline_ms is None or path.rsplit('.', 1)[-1] in UNCOMPARED_TIMINGS:
+            continue
+        if ms > baseline_ms * (1 + tolerance) and ms - baseline_ms > min_delta_ms:
+            slower.append({
+                'timing': path,
+                'baseline_ms': baseline_ms,
+                'ms': ms,
+                'ratio': round(ms / baseline_ms, 3) if baseline_ms else float('inf')
+            })
+    return slower
+
+
+def report_print(report: dict):
+    for path, ms in timings(report['benchmarks']).items():
+        print(f'{ms:>12.3f} ms  {path}')
+
+
+def regressions_print(slower: list[dict], tolerance: float):
+    if not slower:
+        print(f'no regressions beyond {tolerance:.0%} of the baseline')
+        return
+    print(f'{len(slower)} regressions beyond {tolerance:.0%} of the baseline')
+    for r in slower:
+        print(f"  {r['timing']}: {r['baseline_ms']:.3f} ms -> {r['ms']:.3f} ms ({r['ratio']}x)")
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def run():
+    parser = argparse.ArgumentParser(description='run the benchmark suite and compare against a baseline')
+    parser.add_argument('--only', default='', help=f"comma separated benchmarks of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=None, help='repetitions per benchmark, else its own default')
+    parser.add_argument('--output', default='', help='write the report as JSON to this path')
+    parser.add_argument('--compare', default='', help='baseline report JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE_DEFAULT, help='allowed slowdown ratio')
+    parser.add_argument('--min-delta-ms', type=float, default=MIN_DELTA_MS_DEFAULT,
+                        help='slowdowns below this many ms are treated as noise')
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.only.split(',') if n.strip()]
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks {', '.join(unknown)}")
+
+    report = suite_run(names=names, repeat=args.repeat)
+    report_print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        slower = regressions(report, baseline, tolerance=args.tolerance, min_delta_ms=args.min_delta_ms)
+        regressions_print(slower, args.tolerance)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""start-up benchmark for the CLI and worker entry points
+
+python -m benchmarks.startup [--module cli_agent] [--repeat 5] [--top 15]
+
+  - imports the module in a fresh interpreter with python -X importtime, repeat times
+  - reports the median wall time to import the module and the import time of its heaviest dependencies
+    {
+        "module": <module imported>,
+        "wall_ms": <median wall time of the interpreter run>,
+        "import_ms": <median cumulative import time of the module>,
+        "breakdown": [{"package": <top level package>, "cumulative_ms": <median import time>}, ...]
+    }
+
+run from the repository root
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+MODULE_DEFAULT = 'cli_agent'
+REPEAT_DEFAULT = 5
+TOP_DEFAULT = 15
+IMPORTTIME_PREFIX = 'import time:'
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def import_profile(module: str) -> tuple[float, dict[str, float]]:
+    """Imports module in a fresh interpreter. Returns the wall time in ms and cumulative ms per imported package."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith(IMPORTTIME_PREFIX) or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len(IMPORTTIME_PREFIX):].split('|')
+        package = name.strip().split('.')[0]
+        # the outermost import of a package carries the largest cumulative time, covering its submodules
+        cumulative[package] = max(cumulative.get(package, 0.0), int(cumulative_us) / 1000)
+    return wall_ms, cumulative
+
+
+def startup_benchmark(module=MODULE_DEFAULT, repeat=REPEAT_DEFAULT, top=TOP_DEFAULT) -> dict:
+    runs = [import_profile(module) for _ in range(repeat)]
+    packages = {p for _, cumulative in runs for p in cumulative}
+    breakdown = [
+        {
+            'package': p,
+            'cumulative_ms': round(statistics.median(cumulative.get(p, 0.0) for _, cumulative in runs), 3)
+        }
+        for p in packages
+    ]
+    breakdown.sort(key=lambda b: -b['cumulative_ms'])
+    module_package = module.split('.')[0]
+    return {
+        'module': module,
+        'wall_ms': round(statistics.median(wall_ms for wall_ms, _ in runs), 3),
+        'import_ms': round(statistics.median(cumulative.get(module_package, 0.0) for _, cumulative in runs), 3),
+        'breakdown': breakdown[:top]
+    }
+
+
+def report_print(report: dict):
+    print(f"start-up of {report['module']}: wall {report['wall_ms']:.1f} ms, import {report['import_ms']:.1f} ms")
+    for b in report['breakdown']:
+        print(f"  {b['cumulative_ms']:>10.1f} ms  {b['package']}")
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def run():
+    parser = argparse.ArgumentParser(description='measure the import time breakdown of an entry point module')
+    parser.add_argument('--module', default=MODULE_DEFAULT, help='module to import')
+    parser.add_argument('--repeat', type=int, default=REPEAT_DEFAULT, help='number of fresh interpreter runs')
+    parser.add_argument('--top', type=int, default=TOP_DEFAULT, help='number of packages to report')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = startup_benchmark(module=args.module, repeat=args.repeat, top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        report_print(report)
+
+
+if __name__ == '__main__':
+    run()
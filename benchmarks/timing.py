@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""timing helpers shared by the benchmarks
+
+  - time_call() runs a callable and returns its wall time in ms
+  - latency_summary() reduces per-call samples to percentiles
+    {
+        "calls": <number of samples>,
+        "mean_ms": <mean latency>,
+        "p50_ms": <median latency>,
+        "p90_ms": <90th percentile latency>,
+        "p95_ms": <95th percentile latency>,
+        "p99_ms": <99th percentile latency>,
+        "max_ms": <slowest call>
+    }
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import statistics
+import time
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+PERCENTILES = [50, 90, 95, 99]
+DECIMALS = 4
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def time_call(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def percentile(samples: list[float], p: float) -> float:
+    """Linearly interpolated percentile of samples, p in 0 - 100."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (position - low) * (ordered[high] - ordered[low])
+
+
+def latency_summary(samples_ms: list[float]) -> dict:
+    summary = {
+        'calls': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), DECIMALS) if samples_ms else 0.0
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = round(percentile(samples_ms, p), DECIMALS)
+    summary['max_ms'] = round(max(samples_ms), DECIMALS) if samples_ms else 0.0
+    return summary
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""HTTP service for the Roaming Plan Agent, see recommend_agent/service.py for the endpoints
+"""
+# dependencies ---------------------------------------------------
+import argparse
+from recommend_agent.service import HOST_DEFAULT, PORT_DEFAULT, serve
+
+
+# entry point ---------------------------------------------------
+def run():
+    parser = argparse.ArgumentParser(description='serve the roaming plan agent over HTTP')
+    parser.add_argument('--host', default=HOST_DEFAULT, help='interface to listen on')
+    parser.add_argument('--port', type=int, default=PORT_DEFAULT, help='port to listen on')
+    parser.add_argument('--max-concurrency', type=int, default=None, help='requests handled at once')
+    parser.add_argument('--workers', type=int, default=None, help='recommendation thread pool size per process')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='pre-forked worker processes sharing the loaded catalog, 0 for one per core. '
+                             'The /sessions endpoints need a single process and answer 501 otherwise')
+    args = parser.parse_args()
+    serve(
+        host=args.host, port=args.port, max_concurrency=args.max_concurrency, max_workers=args.workers,
+        processes=args.processes
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""response cache for the LLM intent classifier
+
+ResponseCache
+
+  - memory tier: bounded LRU of the most recently used responses
+  - disk tier (optional, db_path): SQLite table that survives restarts, entries expire after ttl_seconds
+    and the least recently used entries are evicted above max_disk_entries
+  - expired entries are dropped lazily on read; the TTL sweep and size trim run once every few writes
+    (at most PRUNE_INTERVAL_WRITES), so the table may briefly hold a few more than max_disk_entries
+  - get() checks the memory tier first, then the disk tier, and promotes disk hits to memory
+  - stats() reports hit and miss counters
+    {
+        "hits": <memory + disk hits>,
+        "memory_hits": <hits served from memory>,
+        "disk_hits": <hits served from disk>,
+        "misses": <lookups not found or expired>,
+        "memory_entries": <entries held in memory>
+    }
+
+cache_key() builds the lookup key from the normalized user input, model name, prompt hash and threshold,
+so that a change to any of them misses the cache rather than returning a stale response.
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from base import BaseHandler
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+MAX_ENTRIES_DEFAULT = 1024
+MAX_DISK_ENTRIES_DEFAULT = 100000
+TTL_SECONDS_DEFAULT = 7 * 24 * 3600
+PRUNE_INTERVAL_WRITES = 256
+CACHE_TABLE = 'response_cache'
+SQL_CACHE_CREATE = f"""CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+    cache_key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);"""
+SQL_CACHE_INDEX = f"CREATE INDEX IF NOT EXISTS idx_{CACHE_TABLE}_accessed_at ON {CACHE_TABLE} (accessed_at);"
+SQL_CACHE_CREATED_INDEX = f"CREATE INDEX IF NOT EXISTS idx_{CACHE_TABLE}_created_at ON {CACHE_TABLE} (created_at);"
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def normalize_input(user_input: str) -> str:
+    return ' '.join(user_input.split()).casefold()
+
+
+def cache_key(user_input: str, llm_model: str, instructions: Optional[str], threshold: float) -> str:
+    prompt_hash = hashlib.sha256((instructions or '').encode('utf-8')).hexdigest()
+    key_json = json.dumps([normalize_input(user_input), llm_model, prompt_hash, float(threshold)])
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class ResponseCache(BaseHandler):
+    def __init__(self, max_entries=None, db_path='', ttl_seconds=None, max_disk_entries=None):
+        self.max_entries: int = max_entries or MAX_ENTRIES_DEFAULT
+        self.db_path: str = db_path
+        self.ttl_seconds: float = ttl_seconds or TTL_SECONDS_DEFAULT
+        self.max_disk_entries: int = max_disk_entries or MAX_DISK_ENTRIES_DEFAULT
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # prune often enough that small caches stay close to max_disk_entries
+        self._prune_interval: int = max(1, min(PRUNE_INTERVAL_WRITES, self.max_disk_entries // 16))
+        self._writes_since_prune = 0
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self._memory)} entries [{self.status()}]>'
+
+    def exit(self):
+        self.close()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns a copy of the cached response, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, response = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return dict(response)
+                del self._memory[key]
+
+            disk_entry = self._disk_get(key, now)
+            if disk_entry is not None:
+                created_at, response = disk_entry
+                self._memory_set(key, created_at, response)
+                self.hits += 1
+                self.disk_hits += 1
+                return dict(response)
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response: dict):
+        now = time.time()
+        with self._lock:
+            self._memory_set(key, now, dict(response))
+            self._disk_set(key, now, response)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk_connect():
+                try:
+                    with self._conn:
+                        self._conn.execute(f'DELETE FROM {CACHE_TABLE}')
+                except Exception as e:
+                    self._exception_handle(msg='failed to clear response cache', exception=e, is_fatal=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory)
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _memory_set(self, key: str, created_at: float, response: dict):
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_connect(self) -> bool:
+        if not self.db_path:
+            return False
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute(SQL_CACHE_CREATE)
+                conn.execute(SQL_CACHE_INDEX)
+                conn.execute(SQL_CACHE_CREATED_INDEX)
+                conn.commit()
+                self._conn = conn
+                self._status_code = 1
+            except Exception as e:
+                # the cache degrades to memory only rather than failing the classifier
+                self._exception_handle(msg='problem opening response cache', exception=e, is_fatal=False)
+                self.db_path = ''
+                return False
+        return True
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple[float, dict]]:
+        if not self._disk_connect():
+            return None
+        try:
+            with self._conn:
+                row = self._conn.execute(
+                    f'SELECT created_at, response FROM {CACHE_TABLE} WHERE cache_key = ?', (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                created_at, response_json = row
+                if now - created_at >= self.ttl_seconds:
+                    self._conn.execute(f'DELETE FROM {CACHE_TABLE} WHERE cache_key = ?', (key,))
+                    return None
+                self._conn.execute(
+                    f'UPDATE {CACHE_TABLE} SET accessed_at = ? WHERE cache_key = ?', (now, key)
+                )
+            return created_at, json.loads(response_json)
+        except Exception as e:
+            self._exception_handle(msg='response cache lookup failed', exception=e, is_fatal=False)
+            return None
+
+    def _disk_set(self, key: str, now: float, response: dict):
+        if not self._disk_connect():
+            return
+        try:
+            with self._conn:
+                self._conn.execute(
+                    f'INSERT OR REPLACE INTO {CACHE_TABLE} (cache_key, response, created_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?)', (key, json.dumps(response), now, now)
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= self._prune_interval:
+                    self._disk_prune(now)
+        except Exception as e:
+            self._exception_handle(msg='response cache write failed', exception=e, is_fatal=False)
+
+    def _disk_prune(self, now: float):
+        """Drops expired entries and trims the table to max_disk_entries, least recently used first."""
+        self._conn.execute(f'DELETE FROM {CACHE_TABLE} WHERE created_at <= ?', (now - self.ttl_seconds,))
+        self._conn.execute(
+            f'DELETE FROM {CACHE_TABLE} WHERE cache_key IN ('
+            f'SELECT cache_key FROM {CACHE_TABLE} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_disk_entries,)
+        )
+        self._writes_since_prune = 0
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""in-memory columnar snapshot of the roaming plans catalog
+
+PlanCatalog.load()
+
+  - reads the plan, ppu_rate and destination tables once from the roaming plans database
+  - keeps each table as NumPy column arrays, with plans ordered by zone so that
+    every zone is a contiguous slice of the plan arrays
+  - builds lookup maps so that recommendations can be answered without SQL
+    - zone -> plan slice
+    - zone -> piecewise-linear PlanCurve of the plan durations, see curves.py
+    - zone -> pay-per-use rates
+    - lowercase country -> zone
+
+The SQLite database remains the source of truth, the snapshot is a read-only copy
+that can be refreshed by calling load() again.
+
+PlanCatalog.load_compiled()
+
+  - maps a compiled catalog file instead of querying the database, see compiled.py
+  - the column arrays are zero-copy views into the mapped file, only the zone -> plan slice map is built on load
+  - plan records, curves, rates and destination maps of the compiled catalog are built on first use
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from typing import Optional
+import numpy as np
+from .compiled import CATALOG_PATH, CompiledCatalog, catalog_open
+from .curves import PlanCurve
+from base import BaseHandler
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+PLAN_COLUMNS = [
+    'id',
+    'zone',
+    'duration_days',
+    'data_gb',
+    'price_sgd'
+]
+RATE_COLUMNS = [
+    'rate_data_per_10kb',
+    'rate_calls_outgoing_per_min',
+    'rate_calls_incoming_per_min',
+    'rate_per_sms'
+]
+PLAN_DTYPES = {
+    'id': np.int64,
+    'zone': np.int64,
+    'duration_days': np.int64,
+    'data_gb': np.float64,
+    'price_sgd': np.float64
+}
+SQL_PLANS = f"SELECT {', '.join(PLAN_COLUMNS)} FROM plan ORDER BY zone, id"
+SQL_RATES = f"SELECT zone, {', '.join(RATE_COLUMNS)} FROM ppu_rate ORDER BY zone"
+SQL_DESTINATIONS = "SELECT country, zone FROM destination"
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class PlanCatalog(BaseHandler):
+    def __init__(self):
+        self.plans: dict[str, np.ndarray] = {}
+        self.rate_zones: np.ndarray = np.empty(0, dtype=np.int64)
+        self.rates: dict[str, np.ndarray] = {}
+        self.zone_slices: dict[int, slice] = {}
+        self.zone_curves: dict[int, PlanCurve] = {}
+        self.zone_rates: dict[int, dict] = {}
+        self.destinations: dict[str, str] = {}
+        self.destination_zones: dict[str, int] = {}
+        self.compiled: Optional[CompiledCatalog] = None
+        self._zone_plans: dict[int, list[dict]] = {}
+        self._zone_rate_rows: dict[int, int] = {}
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.plan_count()} plans [{self.status()}]>'
+
+    def loaded(self):
+        return self._status_code == 1
+
+    def plan_count(self) -> int:
+        return len(self.plans.get('id', []))
+
+    def exit(self):
+        pass
+
+    def load(self, db) -> bool:
+        """Loads a fresh snapshot from a connected DBConnector. Returns True on success."""
+        try:
+            plan_rows = db.execute(SQL_PLANS, re_raise=True)
+            rate_rows = db.execute(SQL_RATES, re_raise=True)
+            destination_rows = db.execute(SQL_DESTINATIONS, re_raise=True)
+        except Exception as e:
+            self._exception_handle(msg='failed to load plan catalog', exception=e)
+            return False
+
+        self.compiled = None
+        self._plans_set(plan_rows)
+        self._rates_set(rate_rows)
+        self._destinations_set(destination_rows)
+        self._status_code = 1
+        self.error = ''
+        return True
+
+    def load_compiled(self, path=CATALOG_PATH, verify=False) -> bool:
+        """Maps a compiled catalog file, verify also checks its checksum. Returns True on success."""
+        try:
+            compiled = catalog_open(path, verify=verify)
+        except Exception as e:
+            self._exception_handle(msg=f'failed to load compiled catalog {path}', exception=e)
+            return False
+
+        plans = compiled.sections['plan']
+        rates = compiled.sections['ppu_rate']
+        self.compiled = compiled
+        self.plans = {c: plans[c] for c in PLAN_COLUMNS}
+        self.rate_zones = rates['zone']
+        self.rates = {c: rates[c] for c in RATE_COLUMNS}
+        self.zone_slices = {}
+        self._zone_rate_rows = {}
+        for zone, start, stop, rate_row in compiled.sections['zone'].tolist():
+            self.zone_slices[zone] = slice(start, stop)
+            if rate_row >= 0:
+                self._zone_rate_rows[zone] = rate_row
+        self.zone_curves = {}
+        self.zone_rates = {}
+        self.destinations = {}
+        self.destination_zones = {}
+        self._zone_plans = {}
+        self._status_code = 1
+        self.error = ''
+        return True
+
+    def _plans_set(self, rows: list[tuple]):
+        columns = list(zip(*rows)) if rows else [[] for _ in PLAN_COLUMNS]
+        self.plans = {
+            c: np.asarray(values, dtype=PLAN_DTYPES[c])
+            for c, values in zip(PLAN_COLUMNS, columns)
+        }
+
+        zones = self.plans['zone']
+        unique_zones, starts, counts = np.unique(zones, return_index=True, return_counts=True)
+        self.zone_slices = {
+            int(z): slice(int(s), int(s + n))
+            for z, s, n in zip(unique_zones, starts, counts)
+        }
+
+        self._zone_plans = {z: self._plan_records(z) for z in self.zone_slices}
+        self.zone_curves = {z: PlanCurve.from_arrays(self.plan_arrays(z)) for z in self.zone_slices}
+
+    def _plan_records(self, zone: int) -> list[dict]:
+        arrays = self.plan_arrays(zone)
+        return [dict(zip(PLAN_COLUMNS, values)) for values in zip(*(arrays[c].tolist() for c in PLAN_COLUMNS))]
+
+    def _rates_set(self, rows: list[tuple]):
+        columns = list(zip(*rows)) if rows else [[] for _ in range(len(RATE_COLUMNS) + 1)]
+        self.rate_zones = np.asarray(columns[0], dtype=np.int64)
+        self.rates = {
+            c: np.asarray(values, dtype=np.float64)
+            for c, values in zip(RATE_COLUMNS, columns[1:])
+        }
+        self.zone_rates = {
+            zone: dict(zip(RATE_COLUMNS, values))
+            for zone, *values in rows
+        }
+        self._zone_rate_rows = {}
+
+    def _destinations_set(self, rows: list[tuple]):
+        self.destinations = {country.lower(): country for country, _ in rows}
+        self.destination_zones = {country.lower(): zone for country, zone in rows}
+
+    def destination_rows(self) -> list[tuple[str, int]]:
+        """(country, zone) of every destination."""
+        if self.compiled is not None:
+            return self.compiled.destination_rows()
+        return [(country, self.destination_zones[key]) for key, country in self.destinations.items()]
+
+    def destination_names(self) -> dict[str, str]:
+        """Lookup dict mapping lowercase country names to canonical country names."""
+        if not self.destinations and self.compiled is not None:
+            self._destinations_set(self.compiled.destination_rows())
+        return dict(self.destinations)
+
+    def zone_for_destination(self, country: str) -> Optional[int]:
+        if not self.destination_zones and self.compiled is not None:
+            self._destinations_set(self.compiled.destination_rows())
+        return self.destination_zones.get(country.lower())
+
+    def plans_for_zone(self, zone: int) -> list[dict]:
+        plans = self._zone_plans.get(zone)
+        if plans is None and zone in self.zone_slices:
+            plans = self._zone_plans[zone] = self._plan_records(zone)
+        return list(plans or [])
+
+    def rates_for_zone(self, zone: int) -> dict:
+        rates = self.zone_rates.get(zone)
+        if rates is None and zone in self._zone_rate_rows:
+            row = self._zone_rate_rows[zone]
+            # NULL rates are stored as NaN in the compiled catalog
+            rates = self.zone_rates[zone] = {
+                c: None if value != value else value
+                for c, value in zip(RATE_COLUMNS, (self.rates[c][row].item() for c in RATE_COLUMNS))
+            }
+        return dict(rates) if rates else {}
+
+    def plan_arrays(self, zone: int) -> dict[str, np.ndarray]:
+        """Returns the column array views for the plans of a zone, in database order."""
+        zone_slice = self.zone_slices.get(zone, slice(0, 0))
+        return {c: values[zone_slice] for c, values in self.plans.items()}
+
+    def curve_for_zone(self, zone: int) -> PlanCurve:
+        curve = self.zone_curves.get(zone)
+        if curve is None and zone in self.zone_slices:
+            curve = self.zone_curves[zone] = PlanCurve.from_arrays(self.plan_arrays(zone))
+        return curve if curve is not None else PlanCurve.from_plans([])
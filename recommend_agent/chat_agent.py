@@ -2,10 +2,18 @@
 """Roaming Plan Recommendation Agent using LangChain
 """
 # dependencies --------------------------------------------------------------------
-from dotenv import load_dotenv
-from base import BaseHandler
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
+# dotenv and langchain are imported on first use to keep start-up fast, see lazy imports in the classes below
+import asyncio
+import random
+import re
+import time
+import uuid
+from typing import Optional
+from base import METRICS, BaseHandler, instrumented
+from .cache import ResponseCache, cache_key
+from .gazetteer import DestinationGazetteer
+from .prompts import PromptCompiler, dedupe_examples, example_text
+from .roaming_plans import DBConnector
 
 
 # constants --------------------------------------------------------------------
@@ -18,69 +26,134 @@ WELCOME_MESSAGE = (
 REDIRECT_URL = "https://example.com/roaming-specialist"
 LLM_MODEL_DEFAULT = "gpt-3.5-turbo"
 RELEVANT_THRESHOLD_DEFAULT = 0.25
-AGENT_INSTRUCTIONS = (
+MAX_CONCURRENCY_DEFAULT = 8
+RETRY_ATTEMPTS_DEFAULT = 5
+RETRY_BACKOFF_SECONDS = 1.0
+SCORE_FIRST_MAX_TOKENS_DEFAULT = 16
+SCORE_PATTERN = re.compile(r"score:\s*\d+(?:\.\d+)?\s", re.IGNORECASE)
+AGENT_ROLE = (
     "You're an assistant that determines how likely it is that a user is asking about mobile roaming, "
     "international SIM cards, or travel-related data/call/SMS services.\n\n"
-    "First, explain your reasoning in 1 sentence.\n"
-    "Then output a relevance score between 0.0 and 1.0 on a new line, labeled as 'Score:'.\n"
+)
+AGENT_GUIDANCE = (
     "Interpret generously. Include travel-related terms, misspellings, poor grammar, "
     "or references to specific places (cities, states, landmarks, etc).\n\n"
     "Examples:\n"
-    "User: I'm going to Japan, do you have data plans?\n"
-    "Reasoning: This user is clearly asking about international mobile service.\n"
-    "Score: 1.0\n\n"
-    "User: Vallhalla for a month\n"
-    "Reasoning: Vallhalla is not a real travel destination for mobile networks.\n"
-    "Score: 0.0\n\n"
-    "User: snorkeling in crystal clear waters\n"
-    "Reasoning: This suggests a travel scenario but needs further clarification to determine mobile needs.\n"
-    "Score: 0.6\n\n"
-    "User: Paris\n"
-    "Reasoning: Paris is a valid travel destination, implying potential roaming needs.\n"
-    "Score: 0.85\n\n"
-    "User: #我去马来西亚旅行三天。\n"
-    "Reasoning: Although it's a valid prompt when translated to English, we are limiting only to English.\n"
-    "Score: 0.0\n\n"
-    "User: Paris\n"
-    "Reasoning: Paris is a valid travel destination, implying potential roaming needs.\n"
-    "Score: 0.85\n\n"
-    "User: What's the weather like in KL?\n"
-    "Reasoning: KL is shorthand for Kuala Lumpur, Malaysia and is a valid travel destination, implying potential roaming needs.\n"
-    "Score: 0.85\n\n"
-    "User: Paris\n"
-    "Reasoning: Paris is a valid travel destination, implying potential roaming needs.\n"
-    "Score: 0.85\n\n"
-    "User: I'm hungry\n"
-    "Reasoning: This is clearly off topic.\n"
-    "Score: 0.0\n\n"
-    "User: I want a pony\n"
-    "Reasoning: This is clearly off topic\n"
-    "Score: 0.0\n\n"
-    "User: I need a lot of data\n"
-    "Reasoning: Mentions data so potentially relevant for a data plan.\n"
-    "Score: 0.7\n\n"
-    "User: remote work for 6 months\n"
-    "Reasoning: Remote working would have data plan needs so this is relevant.\n"
-    "Score: 0.8\n\n"
-    "User: visiting family\n"
-    "Reasoning: Visiting family is a type of travel and thus relevant.\n"
-    "Score: 0.85\n\n"
-    "User: I'm bringing my laptop\n"
-    "Reasoning: Suggestive of travel need more details to confirm.\n"
-    "Score: 0.6\n\n"
-    "User: I need a lot of data\n"
-    "Reasoning: They need data so thats relevant will need to prompt them further to get to specifics.\n"
-    "Score: 0.7\n\n"
-    "User: Unknown Soldier\n"
-    "Reasoning: Too vauge that could mean anything.\n"
-    "Score: 0.0\n\n"
-    "User: Tomb of the Unknown Soldier\n"
-    "Reasoning: Those are specific landmark destinations for travel, albeit there are more than one.\n"
-    "Score: 0.7\n\n"
-    "User: meditation in the Himalayas\n"
-    "Reasoning: A valid travel destination and thus relevant.\n"
-    "Score: 0.85\n\n"
 )
+AGENT_PREAMBLE = (
+    AGENT_ROLE
+    + "First, explain your reasoning in 1 sentence.\n"
+    "Then output a relevance score between 0.0 and 1.0 on a new line, labeled as 'Score:'.\n"
+    + AGENT_GUIDANCE
+)
+AGENT_PREAMBLE_SCORE_FIRST = (
+    AGENT_ROLE
+    + "First, output a relevance score between 0.0 and 1.0 on its own line, labeled as 'Score:'.\n"
+    "Then explain your reasoning in 1 sentence on a new line, labeled as 'Reasoning:'.\n"
+    + AGENT_GUIDANCE
+)
+AGENT_EXAMPLES = [
+    {
+        "user": "I'm going to Japan, do you have data plans?",
+        "reasoning": "This user is clearly asking about international mobile service.",
+        "score": 1.0
+    },
+    {
+        "user": "Vallhalla for a month",
+        "reasoning": "Vallhalla is not a real travel destination for mobile networks.",
+        "score": 0.0
+    },
+    {
+        "user": "snorkeling in crystal clear waters",
+        "reasoning": "This suggests a travel scenario but needs further clarification to determine mobile needs.",
+        "score": 0.6
+    },
+    {
+        "user": "Paris",
+        "reasoning": "Paris is a valid travel destination, implying potential roaming needs.",
+        "score": 0.85
+    },
+    {
+        "user": "#我去马来西亚旅行三天。",
+        "reasoning": "Although it's a valid prompt when translated to English, we are limiting only to English.",
+        "score": 0.0
+    },
+    {
+        "user": "Paris",
+        "reasoning": "Paris is a valid travel destination, implying potential roaming needs.",
+        "score": 0.85
+    },
+    {
+        "user": "What's the weather like in KL?",
+        "reasoning": "KL is shorthand for Kuala Lumpur, Malaysia and is a valid travel destination, implying potential roaming needs.",
+        "score": 0.85
+    },
+    {
+        "user": "Paris",
+        "reasoning": "Paris is a valid travel destination, implying potential roaming needs.",
+        "score": 0.85
+    },
+    {
+        "user": "I'm hungry",
+        "reasoning": "This is clearly off topic.",
+        "score": 0.0
+    },
+    {
+        "user": "I want a pony",
+        "reasoning": "This is clearly off topic",
+        "score": 0.0
+    },
+    {
+        "user": "I need a lot of data",
+        "reasoning": "Mentions data so potentially relevant for a data plan.",
+        "score": 0.7
+    },
+    {
+        "user": "remote work for 6 months",
+        "reasoning": "Remote working would have data plan needs so this is relevant.",
+        "score": 0.8
+    },
+    {
+        "user": "visiting family",
+        "reasoning": "Visiting family is a type of travel and thus relevant.",
+        "score": 0.85
+    },
+    {
+        "user": "I'm bringing my laptop",
+        "reasoning": "Suggestive of travel need more details to confirm.",
+        "score": 0.6
+    },
+    {
+        "user": "I need a lot of data",
+        "reasoning": "They need data so thats relevant will need to prompt them further to get to specifics.",
+        "score": 0.7
+    },
+    {
+        "user": "Unknown Soldier",
+        "reasoning": "Too vauge that could mean anything.",
+        "score": 0.0
+    },
+    {
+        "user": "Tomb of the Unknown Soldier",
+        "reasoning": "Those are specific landmark destinations for travel, albeit there are more than one.",
+        "score": 0.7
+    },
+    {
+        "user": "meditation in the Himalayas",
+        "reasoning": "A valid travel destination and thus relevant.",
+        "score": 0.85
+    }
+]
+AGENT_INSTRUCTIONS = AGENT_PREAMBLE + "".join(example_text(e) for e in dedupe_examples(AGENT_EXAMPLES))
+AGENT_INSTRUCTIONS_SCORE_FIRST = AGENT_PREAMBLE_SCORE_FIRST + "".join(
+    example_text(e, score_first=True) for e in dedupe_examples(AGENT_EXAMPLES)
+)
+
+
+# helper functions -------------------------------------------------------------------
+def is_rate_limit_error(exception: Exception) -> bool:
+    """True for the OpenAI RateLimitError or any error carrying HTTP status 429, without importing openai."""
+    return type(exception).__name__ == 'RateLimitError' or getattr(exception, 'status_code', None) == 429
 
 
 # classes ----------------------------------------------------------------------------
@@ -91,16 +164,80 @@ class BaseLLMIntentClassifier(BaseHandler):
     Subclasses should supply:
     - a system prompt (instructions + examples)
     - an optional score threshold (default 0.5)
+
+    An optional pre-filter, any object whose classify() returns {"reason", "score"} or None,
+    answers the inputs it recognises locally. An optional ResponseCache skips the LLM call
+    for inputs already classified with the same model, prompt and threshold.
+    With a PromptCompiler the system prompt is compiled per request from the few-shot
+    examples most similar to the input, instead of the static instructions.
+
+    classify_many(), aclassify() and aclassify_many() send prompts through the LLM batch
+    and async interfaces, at most max_concurrency in flight, and retry rate-limited
+    requests with exponential backoff up to retry_attempts times.
+
+    With score_first the instructions must ask for the score before the reasoning. classify() and
+    aclassify() then stream the response and stop reading once a complete score has arrived, and
+    every request is capped at max_tokens output tokens. The reasoning is optional in this mode.
+
+    With instrumentation enabled, see base.py, the LLM calls are timed as 'llm' spans and the
+    requests, prompt tokens and reported token usage are counted per model.
     """
 
-    def __init__(self, llm=None, llm_model='', instructions=None, threshold=None, logging_level=None):
-        load_dotenv()
+    def __init__(self, llm=None, llm_model='', instructions=None, threshold=None, logging_level=None,
+                 cache: Optional[ResponseCache] = None, max_concurrency=None, retry_attempts=None, prefilter=None,
+                 prompt_compiler: Optional[PromptCompiler] = None, score_first=False, max_tokens=None):
         self.llm_model = llm_model or LLM_MODEL_DEFAULT
-        self.llm = llm or ChatOpenAI(model=self.llm_model, temperature=0)
+        self._llm = llm
         self.instructions = instructions
+        self.prompt_compiler = prompt_compiler
         self.threshold: float = threshold or RELEVANT_THRESHOLD_DEFAULT
         self.logging_level = logging_level or LOGGING_LEVEL_DEFAULT
+        self.cache = cache
+        self._prefilter = prefilter
+        self.max_concurrency: int = max_concurrency or MAX_CONCURRENCY_DEFAULT
+        self.retry_attempts: int = RETRY_ATTEMPTS_DEFAULT if retry_attempts is None else retry_attempts
+        self.score_first: bool = score_first
+        self.max_tokens: int = max_tokens or SCORE_FIRST_MAX_TOKENS_DEFAULT
+        super().__init__()
+
+    @property
+    def llm(self):
+        """The chat model, an OpenAI client is created on first use unless one was injected."""
+        if self._llm is None:
+            from dotenv import load_dotenv
+            from langchain_openai import ChatOpenAI
+            load_dotenv()
+            self._llm = ChatOpenAI(model=self.llm_model, temperature=0)
+        return self._llm
 
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    @property
+    def prefilter(self):
+        return self._prefilter
+
+    @prefilter.setter
+    def prefilter(self, prefilter):
+        self._prefilter = prefilter
+
+    def _messages(self, user_input: str) -> list:
+        from langchain.schema import SystemMessage, HumanMessage
+        if self.prompt_compiler is not None:
+            prompt = self.prompt_compiler.compile(user_input)
+            self.metric_count('llm_prompt_tokens_total', prompt['token_count'], model=self.llm_model)
+            if self.logging_level == 0:
+                print(f"Prompt tokens: {prompt['token_count']}")
+            instructions = prompt['text']
+        else:
+            instructions = self.instructions
+        return [
+            SystemMessage(content=instructions),
+            HumanMessage(content=user_input.strip())
+        ]
+
+    @instrumented('classify')
     def classify(self, user_input: str) -> dict:
         """
         Runs LLM classification on the given input.
@@ -111,11 +248,119 @@ class BaseLLMIntentClassifier(BaseHandler):
                 "redirect": bool
             }
         """
-        response = self.llm.invoke([
-            SystemMessage(content=self.instructions),
-            HumanMessage(content=user_input.strip())
-        ])
-        text = response.content.strip()
+        local = self._local_result(user_input)
+        if local is not None:
+            return local
+
+        messages = self._messages(user_input)
+        with self.span('llm'):
+            if self.score_first:
+                response = None
+                text = self._stream_text(self.llm.stream(messages, **self._llm_kwargs()))
+            else:
+                response = self.llm.invoke(messages)
+                text = response.content
+        self._usage_record(response)
+        return self._cache_set(user_input, self._parse(text))
+
+    @instrumented('classify_many')
+    def classify_many(self, user_inputs: list[str], max_concurrency=None) -> list[dict]:
+        """
+        Classifies many inputs with the LLM batch interface, repeated inputs are sent once.
+        Returns the classify() result for each input, in input order. Inputs that still fail
+        after the retries get {"reason", "score": 0.0, "redirect": False, "error": str}.
+        """
+        user_inputs = list(user_inputs)
+        results, pending = self._batch_pending(user_inputs)
+        prompts = list(pending)
+        responses = self._batch_invoke([self._messages(p) for p in prompts], max_concurrency)
+        for prompt, response in zip(prompts, responses):
+            self._batch_results_set(results, user_inputs, pending[prompt], response)
+        return results
+
+    @instrumented('aclassify')
+    async def aclassify(self, user_input: str) -> dict:
+        """Async version of classify(), rate-limited requests are retried with backoff."""
+        local = self._local_result(user_input)
+        if local is not None:
+            return local
+
+        messages = self._messages(user_input)
+        for attempt in range(self.retry_attempts + 1):
+            try:
+                with self.span('llm'):
+                    if self.score_first:
+                        response = None
+                        text = await self._astream_text(self.llm.astream(messages, **self._llm_kwargs()))
+                    else:
+                        response = await self.llm.ainvoke(messages)
+                        text = response.content
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.retry_attempts:
+                    raise
+                await asyncio.sleep(self._backoff_seconds(attempt))
+        self._usage_record(response)
+        return self._cache_set(user_input, self._parse(text))
+
+    async def aclassify_many(self, user_inputs: list[str], max_concurrency=None) -> list[dict]:
+        """Async version of classify_many(), at most max_concurrency requests are awaited at once."""
+        user_inputs = list(user_inputs)
+        results, pending = self._batch_pending(user_inputs)
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def classify_limited(prompt):
+            async with semaphore:
+                return await self.aclassify(prompt)
+
+        prompts = list(pending)
+        responses = await asyncio.gather(*(classify_limited(p) for p in prompts), return_exceptions=True)
+        for prompt, response in zip(prompts, responses):
+            self._batch_results_set(results, user_inputs, pending[prompt], response)
+        return results
+
+    def _usage_record(self, response):
+        """Counts an LLM request and the token usage the response reports, streamed responses report none."""
+        if not METRICS.enabled:
+            return
+        self.metric_count('llm_requests_total', model=self.llm_model)
+        usage = getattr(response, 'usage_metadata', None) or {}
+        for kind in ['input_tokens', 'output_tokens']:
+            if usage.get(kind):
+                self.metric_count('llm_tokens_total', usage[kind], model=self.llm_model, kind=kind)
+
+    def _llm_kwargs(self) -> dict:
+        return {'max_tokens': self.max_tokens} if self.score_first else {}
+
+    @staticmethod
+    def _stream_text(stream) -> str:
+        """Reads streamed chunks until a complete score has arrived, then closes the stream."""
+        text = ''
+        try:
+            for chunk in stream:
+                text += chunk.content
+                if SCORE_PATTERN.search(text):
+                    break
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()
+        return text
+
+    @staticmethod
+    async def _astream_text(stream) -> str:
+        text = ''
+        try:
+            async for chunk in stream:
+                text += chunk.content
+                if SCORE_PATTERN.search(text):
+                    break
+        finally:
+            if hasattr(stream, 'aclose'):
+                await stream.aclose()
+        return text
+
+    def _parse(self, content: str) -> dict:
+        text = content.strip()
         lines = text.splitlines()
 
         reason = next((l for l in lines if l and not l.lower().startswith("score:")), "[no reasoning]")
@@ -132,47 +377,197 @@ class BaseLLMIntentClassifier(BaseHandler):
             "redirect": score >= self.threshold
         }
 
+    def _local_result(self, user_input: str) -> Optional[dict]:
+        """Result from the pre-filter or the cache, None when the input needs the LLM."""
+        if self.prefilter is not None:
+            matched = self.prefilter.classify(user_input)
+            if matched is not None:
+                return {**matched, "redirect": matched["score"] >= self.threshold}
+        return self._cache_get(user_input)
+
+    def _prompt_id(self) -> Optional[str]:
+        if self.prompt_compiler is not None:
+            return self.prompt_compiler.fingerprint()
+        return self.instructions
+
+    def _cache_get(self, user_input: str) -> Optional[dict]:
+        if self.cache is None:
+            return None
+        return self.cache.get(cache_key(user_input, self.llm_model, self._prompt_id(), self.threshold))
+
+    def _cache_set(self, user_input: str, result: dict) -> dict:
+        if self.cache is not None:
+            self.cache.set(cache_key(user_input, self.llm_model, self._prompt_id(), self.threshold), result)
+        return result
+
+    def _batch_pending(self, user_inputs: list[str]) -> tuple[list, dict[str, list[int]]]:
+        """Fills the pre-filter and cached results and groups the remaining input positions by prompt."""
+        results = [None] * len(user_inputs)
+        pending = {}
+        for i, user_input in enumerate(user_inputs):
+            local = self._local_result(user_input)
+            if local is not None:
+                results[i] = local
+            else:
+                pending.setdefault(user_input.strip(), []).append(i)
+        return results, pending
+
+    def _batch_results_set(self, results: list, user_inputs: list[str], indices: list[int], response):
+        if isinstance(response, Exception):
+            ex_msg = f'classification failed: {response}'
+            self._exception_handle(msg=ex_msg, exception=response, is_fatal=False)
+            result = {"reason": "[no reasoning]", "score": 0.0, "redirect": False, "error": ex_msg}
+        elif isinstance(response, dict):
+            result = response
+        else:
+            self._usage_record(response)
+            result = self._cache_set(user_inputs[indices[0]], self._parse(response.content))
+        for i in indices:
+            results[i] = dict(result)
+
+    def _batch_invoke(self, messages: list[list], max_concurrency=None) -> list:
+        """Runs llm.batch() and resubmits only the rate-limited prompts. Failures are returned in place."""
+        responses = [None] * len(messages)
+        todo = list(range(len(messages)))
+        config = {'max_concurrency': max_concurrency or self.max_concurrency}
+        for attempt in range(self.retry_attempts + 1):
+            if not todo:
+                break
+            with self.span('llm_batch'):
+                batch = self.llm.batch(
+                    [messages[i] for i in todo], config=config, return_exceptions=True, **self._llm_kwargs()
+                )
+            retry = []
+            for i, response in zip(todo, batch):
+                responses[i] = response
+                if isinstance(response, Exception) and is_rate_limit_error(response):
+                    retry.append(i)
+            if retry and attempt < self.retry_attempts:
+                time.sleep(self._backoff_seconds(attempt))
+            todo = retry
+        return responses
+
+    @staticmethod
+    def _backoff_seconds(attempt: int) -> float:
+        return RETRY_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random())
+
 
 class RoamingIntentClassifier(BaseLLMIntentClassifier):
     """
     A specialized intent classifier that detects roaming/mobile travel-related requests.
+
+    Inputs naming a destination from the roaming plans database are redirected by the
+    DestinationGazetteer pre-filter without an LLM call, unless destination_prefilter is False.
+    Each prompt carries the few_shot_k examples most similar to the input, all of them with few_shot_k=0.
+    score_first=True switches to the streaming score-first prompt and parsing.
     """
 
-    def __init__(self, llm=None, llm_model='', threshold=None, logging_level=None):
+    def __init__(self, llm=None, llm_model='', threshold=None, logging_level=None, cache=None,
+                 max_concurrency=None, retry_attempts=None, prefilter=None, destination_prefilter=True,
+                 few_shot_k=None, score_first=False, max_tokens=None):
+        self.destination_prefilter: bool = destination_prefilter
+        preamble = AGENT_PREAMBLE_SCORE_FIRST if score_first else AGENT_PREAMBLE
+        prompt_compiler = None
+        if few_shot_k != 0:
+            prompt_compiler = PromptCompiler(preamble, AGENT_EXAMPLES, k=few_shot_k, score_first=score_first)
         super().__init__(
             llm_model=llm_model,
             llm=llm,
-            instructions=AGENT_INSTRUCTIONS,
+            instructions=AGENT_INSTRUCTIONS_SCORE_FIRST if score_first else AGENT_INSTRUCTIONS,
             threshold=threshold,
-            logging_level=logging_level
+            logging_level=logging_level,
+            cache=cache,
+            max_concurrency=max_concurrency,
+            retry_attempts=retry_attempts,
+            prefilter=prefilter,
+            prompt_compiler=prompt_compiler,
+            score_first=score_first,
+            max_tokens=max_tokens
         )
 
+    @property
+    def prefilter(self):
+        """The pre-filter, a DestinationGazetteer is loaded from the roaming plans database on first use."""
+        if self._prefilter is None and self.destination_prefilter:
+            gazetteer = DestinationGazetteer()
+            db = DBConnector(read_only=True)
+            if not gazetteer.load(db):
+                # without the database only the alias list is matched
+                gazetteer.build([])
+            db.close()
+            self._prefilter = gazetteer
+        return self._prefilter
+
+    @prefilter.setter
+    def prefilter(self, prefilter):
+        self._prefilter = prefilter
+
 
 class DialogueManager(BaseHandler):
     """
     Self-contained conversation manager for CLI interaction.
     Handles classification, clarification, and optional redirect.
+
+    astep() and arun() serve many concurrent conversations from one event loop,
+    each tracked by its session id in sessions.
     """
 
     def __init__(self, welcome_message='', redirect_url=None, 
-                 intent_classifier_llm_model='', intent_classifier_threshold='', logging_level=None):
+                 intent_classifier_llm_model='', intent_classifier_threshold='', logging_level=None,
+                 intent_classifier_cache=None, intent_classifier_llm=None):
         self.welcome_message = welcome_message or WELCOME_MESSAGE
         self.redirect_url = redirect_url or REDIRECT_URL
         self.logging_level = logging_level or LOGGING_LEVEL_DEFAULT
         self.intent_classifier_llm_model = intent_classifier_llm_model or LLM_MODEL_DEFAULT
         self.intent_classifier_threshold = intent_classifier_threshold or RELEVANT_THRESHOLD_DEFAULT
-        self.classifier = RoamingIntentClassifier(
-            llm_model=self.intent_classifier_llm_model, 
-            logging_level=self.logging_level,
-            threshold=self.intent_classifier_threshold
-            )
+        self.intent_classifier_cache = intent_classifier_cache
+        self.intent_classifier_llm = intent_classifier_llm
+        self.sessions: dict[str, dict] = {}
+        self._classifier = None
+        super().__init__()
+
+    @property
+    def classifier(self):
+        """The intent classifier, built on the first user input rather than before the welcome message."""
+        if self._classifier is None:
+            self._classifier = RoamingIntentClassifier(
+                llm_model=self.intent_classifier_llm_model,
+                logging_level=self.logging_level,
+                threshold=self.intent_classifier_threshold,
+                cache=self.intent_classifier_cache,
+                llm=self.intent_classifier_llm
+                )
+        return self._classifier
+
+    @classifier.setter
+    def classifier(self, classifier):
+        self._classifier = classifier
 
+    @instrumented('step')
     def step(self, user_input: str) -> dict:
         """
         Classify a single input. Returns response message and optional redirect.
         """
         result = self.classifier.classify(user_input)
+        return self._response(result)
+
+    @instrumented('astep')
+    async def astep(self, user_input: str, session_id: Optional[str] = None) -> dict:
+        """
+        Async version of step() that awaits the classifier without blocking the event loop.
+        With a session_id the turn is recorded on that session, which is ended on redirect.
+        """
+        result = await self.classifier.aclassify(user_input)
+        response = self._response(result)
+        if session_id is not None:
+            session = self.sessions.get(session_id) or self.session_start(session_id)
+            session['turns'] += 1
+            if "redirect" in response:
+                self.session_end(session_id)
+            response = {**response, "session_id": session_id}
+        return response
 
+    def _response(self, result: dict) -> dict:
         if self.logging_level == 0:
             print(f"Reason: {result['reason']}")
             print(f"Score: {result['score']}")
@@ -187,6 +582,40 @@ class DialogueManager(BaseHandler):
                 "message": "I'm here to help with roaming plans. Could you clarify your request?"
             }
 
+    def session_start(self, session_id: Optional[str] = None) -> dict:
+        """Opens a conversation, a session id is generated unless given. Returns the session state."""
+        session_id = session_id or uuid.uuid4().hex
+        session = {'session_id': session_id, 'turns': 0}
+        self.sessions[session_id] = session
+        return session
+
+    def session_end(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    async def arun(self, receive, send, session_id: Optional[str] = None):
+        """
+        Async version of run() for one conversation on a shared event loop.
+        receive: coroutine function returning the next user input
+        send: coroutine function taking an agent message
+        Many conversations are served concurrently with asyncio.gather(manager.arun(...), ...).
+        """
+        session_id = self.session_start(session_id)['session_id']
+        try:
+            await send(self.welcome_message)
+            while session_id in self.sessions:
+                user_input = (await receive()).strip()
+                if user_input.lower() in {"exit", "quit"}:
+                    await send("👋 Goodbye!")
+                    break
+
+                response = await self.astep(user_input, session_id=session_id)
+                await send(f"Agent: {response['message']}")
+
+                if "redirect" in response:
+                    await send(response["redirect"])
+        finally:
+            self.session_end(session_id)
+
     def run(self):
         """
         Launch the full CLI interaction loop.
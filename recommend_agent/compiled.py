@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""compiled binary roaming plans catalog, memory-mapped for zero-copy loading
+
+catalog_compile()
+
+  - writes the plan, ppu_rate and destination tables of the roaming plans database into one binary file
+    of fixed-width little-endian struct arrays, plus a UTF-8 string table of the country names
+  - the file is written to a temporary path and moved into place, so that readers never see half a file
+  - the header records the build hashes of the source tables, catalog_fresh() compares them with the database
+
+catalog_open()
+
+  - maps the file read-only with mmap and checks the header and section bounds
+  - returns NumPy structured arrays that are views into the mapping, nothing is parsed or copied,
+    so opening takes the same time for any catalog size
+  - verify=True also checks the CRC32 checksum of the sections, which reads the whole file
+
+file layout, all integers little-endian
+    header          magic b'RPCATLG\\0', version u4, section count u4, checksum u4, reserved u4,
+                    source hash 32 bytes
+    section table   per section: name 16 bytes, offset u8, size u8, count u8
+    sections        each starting on an 8 byte boundary
+        plan          id i8, zone i8, duration_days i8, data_gb f8, price_sgd f8, ordered by zone, id
+        ppu_rate      zone i8, rate columns f8 with NaN for NULL, ordered by zone
+        destination   zone i8, name_offset u4, name_size u4 into strings, ordered by country
+        zone          zone i8, plan_start u8, plan_stop u8, rate_row i8 (-1 without rates), ordered by zone
+        strings       UTF-8 country names
+
+python -m recommend_agent.compiled [--output plans.catalog] [--verify]
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from typing import Optional
+import numpy as np
+from .roaming_plans import BUILD_META_TABLE, DBConnector
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+CATALOG_PATH = 'plans.catalog'
+CATALOG_MAGIC = b'RPCATLG\0'
+CATALOG_VERSION = 1
+HEADER_FORMAT = '<8sIIII32s'
+SECTION_FORMAT = '<16sQQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SECTION_SIZE = struct.calcsize(SECTION_FORMAT)
+ALIGNMENT = 8
+SOURCE_TABLES = ['destination', 'plan', 'ppu_rate']
+PLAN_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('zone', '<i8'),
+    ('duration_days', '<i8'),
+    ('data_gb', '<f8'),
+    ('price_sgd', '<f8')
+])
+RATE_DTYPE = np.dtype([
+    ('zone', '<i8'),
+    ('rate_data_per_10kb', '<f8'),
+    ('rate_calls_outgoing_per_min', '<f8'),
+    ('rate_calls_incoming_per_min', '<f8'),
+    ('rate_per_sms', '<f8')
+])
+DESTINATION_DTYPE = np.dtype([
+    ('zone', '<i8'),
+    ('name_offset', '<u4'),
+    ('name_size', '<u4')
+])
+ZONE_DTYPE = np.dtype([
+    ('zone', '<i8'),
+    ('plan_start', '<u8'),
+    ('plan_stop', '<u8'),
+    ('rate_row', '<i8')
+])
+SECTION_DTYPES = {
+    'plan': PLAN_DTYPE,
+    'ppu_rate': RATE_DTYPE,
+    'destination': DESTINATION_DTYPE,
+    'zone': ZONE_DTYPE,
+    'strings': np.dtype('u1')
+}
+SQL_PLANS = f"SELECT {', '.join(PLAN_DTYPE.names)} FROM plan ORDER BY zone, id"
+SQL_RATES = f"SELECT {', '.join(RATE_DTYPE.names)} FROM ppu_rate ORDER BY zone"
+SQL_DESTINATIONS = "SELECT country, zone FROM destination ORDER BY country"
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def source_hash(db: DBConnector) -> Optional[str]:
+    """Hash of the last build hashes of the source tables, None if any of them has not been built."""
+    rows = db.execute(
+        f"SELECT table_name, schema_hash, data_hash FROM {BUILD_META_TABLE} "
+        f"WHERE table_name IN ({', '.join('?' for _ in SOURCE_TABLES)}) ORDER BY table_name",
+        args=tuple(SOURCE_TABLES)
+    )
+    if not rows or len(rows) != len(SOURCE_TABLES):
+        return None
+    return hashlib.sha256(json.dumps([list(r) for r in rows]).encode('utf-8')).hexdigest()
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _sections_build(plan_rows: list, rate_rows: list, destination_rows: list) -> dict[str, np.ndarray]:
+    plans = np.array([tuple(r) for r in plan_rows], dtype=PLAN_DTYPE)
+    rates = np.array(
+        [tuple(np.nan if v is None else v for v in r) for r in rate_rows], dtype=RATE_DTYPE
+    )
+
+    names = [country.encode('utf-8') for country, _ in destination_rows]
+    offsets = np.cumsum([0] + [len(n) for n in names[:-1]]) if names else []
+    destinations = np.array(
+        [(zone, offset, len(name)) for (_, zone), offset, name in zip(destination_rows, offsets, names)],
+        dtype=DESTINATION_DTYPE
+    )
+    strings = np.frombuffer(b''.join(names), dtype=np.uint8)
+
+    unique_zones, starts, counts = np.unique(plans['zone'], return_index=True, return_counts=True)
+    zones = np.zeros(len(unique_zones), dtype=ZONE_DTYPE)
+    zones['zone'] = unique_zones
+    zones['plan_start'] = starts
+    zones['plan_stop'] = starts + counts
+    rate_row = np.searchsorted(rates['zone'], unique_zones)
+    has_rates = rate_row < len(rates)
+    has_rates[has_rates] = rates['zone'][rate_row[has_rates]] == unique_zones[has_rates]
+    zones['rate_row'] = np.where(has_rates, rate_row, -1)
+
+    return {'plan': plans, 'ppu_rate': rates, 'destination': destinations, 'zone': zones, 'strings': strings}
+
+
+def catalog_write(path: str, sections: dict[str, np.ndarray], source: str = ''):
+    """Writes the section arrays with header and section table to path, through a temporary file."""
+    offset = _aligned(HEADER_SIZE + SECTION_SIZE * len(sections))
+    table, payload = [], []
+    for name, array in sections.items():
+        data = np.ascontiguousarray(array, dtype=SECTION_DTYPES[name]).tobytes()
+        table.append(struct.pack(SECTION_FORMAT, name.encode('ascii'), offset, len(data), len(array)))
+        padding = _aligned(offset + len(data)) - offset - len(data)
+        payload.append(data + b'\0' * padding)
+        offset += len(data) + padding
+    body = b''.join(payload)
+    checksum = zlib.crc32(body)
+    header = struct.pack(
+        HEADER_FORMAT, CATALOG_MAGIC, CATALOG_VERSION, len(sections), checksum, 0, bytes.fromhex(source or '0' * 64)
+    )
+    prefix = header + b''.join(table)
+    prefix += b'\0' * (_aligned(len(prefix)) - len(prefix))
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(prefix)
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class CatalogFormatError(ValueError):
+    pass
+
+
+class CompiledCatalog:
+    """Read-only mapping of a compiled catalog file with structured array views of its sections."""
+
+    def __init__(self, path: str, buffer: mmap.mmap, sections: dict[str, np.ndarray], source: str,
+                 checksum: int, body_offset: int):
+        self.path = path
+        self.buffer = buffer
+        self.sections = sections
+        self.source = source
+        self.checksum = checksum
+        self.body_offset = body_offset
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.path}, {len(self.sections["plan"])} plans>'
+
+    def verify(self) -> bool:
+        """True if the CRC32 of the section bytes matches the header, reads the whole file."""
+        return zlib.crc32(memoryview(self.buffer)[self.body_offset:]) == self.checksum
+
+    def destination_rows(self) -> list[tuple[str, int]]:
+        """(country, zone) of every destination, decoded from the string table."""
+        strings = bytes(self.sections['strings'])
+        return [
+            (strings[offset:offset + size].decode('utf-8'), zone)
+            for zone, offset, size in self.sections['destination'].tolist()
+        ]
+
+
+def catalog_open(path=CATALOG_PATH, verify=False) -> CompiledCatalog:
+    """Maps a compiled catalog read-only. Raises CatalogFormatError if the file is not a valid catalog."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER_SIZE:
+            raise CatalogFormatError(f'{path} is too short for a catalog header')
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, section_count, checksum, _, source = struct.unpack_from(HEADER_FORMAT, buffer, 0)
+    if magic != CATALOG_MAGIC:
+        raise CatalogFormatError(f'{path} is not a compiled catalog')
+    if version != CATALOG_VERSION:
+        raise CatalogFormatError(f'{path} has catalog version {version}, expected {CATALOG_VERSION}')
+    if HEADER_SIZE + SECTION_SIZE * section_count > size:
+        raise CatalogFormatError(f'{path} is truncated')
+
+    sections, body_offset = {}, size
+    for i in range(section_count):
+        name, offset, length, count = struct.unpack_from(SECTION_FORMAT, buffer, HEADER_SIZE + SECTION_SIZE * i)
+        name = name.rstrip(b'\0').decode('ascii')
+        dtype = SECTION_DTYPES.get(name)
+        if dtype is None:
+            continue
+        if offset % ALIGNMENT or offset + length > size or length != count * dtype.itemsize:
+            raise CatalogFormatError(f'{path} has an invalid {name} section')
+        sections[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        body_offset = min(body_offset, offset)
+    missing = set(SECTION_DTYPES) - set(sections)
+    if missing:
+        raise CatalogFormatError(f'{path} is missing the sections {", ".join(sorted(missing))}')
+
+    catalog = CompiledCatalog(path, buffer, sections, source.hex(), checksum, body_offset)
+    if verify and not catalog.verify():
+        raise CatalogFormatError(f'{path} failed its checksum')
+    return catalog
+
+
+def catalog_fresh(db: DBConnector, path=CATALOG_PATH) -> bool:
+    """True if the compiled catalog exists and was compiled from the current database tables."""
+    if not os.path.exists(path):
+        return False
+    try:
+        catalog = catalog_open(path)
+    except (OSError, CatalogFormatError):
+        return False
+    current = source_hash(db)
+    return bool(current) and catalog.source == current
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def catalog_compile(db: Optional[DBConnector] = None, path=CATALOG_PATH) -> bool:
+    """Compiles the plan, ppu_rate and destination tables of a connected database into path. Returns True on success."""
+    db = db or DBConnector(read_only=True)
+    if not db.connect():
+        return False
+    try:
+        plan_rows = db.execute(SQL_PLANS, re_raise=True)
+        rate_rows = db.execute(SQL_RATES, re_raise=True)
+        destination_rows = db.execute(SQL_DESTINATIONS, re_raise=True)
+        catalog_write(path, _sections_build(plan_rows, rate_rows, destination_rows), source=source_hash(db) or '')
+    except Exception as e:
+        db._exception_handle(msg=f'failed to compile catalog {path}', exception=e, is_fatal=False)
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compile the roaming plans database into a binary catalog')
+    parser.add_argument('--output', default=CATALOG_PATH, help='compiled catalog path')
+    parser.add_argument('--verify', action='store_true', help='reopen the catalog and check its checksum')
+    cli_args = parser.parse_args()
+    if not catalog_compile(path=cli_args.output):
+        sys.exit(1)
+    if cli_args.verify:
+        catalog_open(cli_args.output, verify=True)
+    print(f'compiled {cli_args.output}')
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""piecewise-linear plan curves for interpolating plans between the durations of a zone
+
+PlanCurve
+
+  - built once per zone from the plan rows, as sorted NumPy arrays of the distinct duration_days
+    with the data_gb and price_sgd of the first plan of each duration
+  - interpolate() evaluates many durations in one vectorized call
+    {
+        "valid": <True where a plan below and a plan above the duration exist>,
+        "data_gb": <interpolated GB, rounded to 2 decimals>,
+        "price_sgd": <interpolated price $, rounded to 2 decimals>
+    }
+  - interpolate_plan() returns the synthetic plan for one duration, or None outside the curve
+  - the neighbours of a duration are the nearest plan durations strictly below and strictly above it,
+    durations at or beyond either end of the curve cannot be interpolated
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from typing import Optional
+import numpy as np
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+CURVE_FIELDS = ['data_gb', 'price_sgd']
+ROUND_DECIMALS = 2
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class PlanCurve:
+    def __init__(self, durations: np.ndarray, values: dict[str, np.ndarray]):
+        self.durations: np.ndarray = durations
+        self.values: dict[str, np.ndarray] = values
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self.durations)} durations>'
+
+    def __len__(self):
+        return len(self.durations)
+
+    @classmethod
+    def from_arrays(cls, plans: dict[str, np.ndarray]) -> 'PlanCurve':
+        """Curve of plan column arrays, the first plan of each duration in array order wins."""
+        durations, first_rows = np.unique(np.asarray(plans['duration_days'], dtype=np.float64), return_index=True)
+        values = {
+            field: np.asarray(plans[field], dtype=np.float64)[first_rows]
+            for field in CURVE_FIELDS
+        }
+        return cls(durations, values)
+
+    @classmethod
+    def from_plans(cls, plans: list[dict]) -> 'PlanCurve':
+        return cls.from_arrays({
+            field: [p[field] for p in plans]
+            for field in ['duration_days'] + CURVE_FIELDS
+        })
+
+    def contains(self, durations) -> np.ndarray:
+        """True where a plan of exactly that duration exists."""
+        durations = np.asarray(durations, dtype=np.float64)
+        if not len(self.durations):
+            return np.zeros(durations.shape, dtype=bool)
+        position = np.minimum(np.searchsorted(self.durations, durations), len(self.durations) - 1)
+        return self.durations[position] == durations
+
+    def interpolate(self, durations, rounded=True) -> dict[str, np.ndarray]:
+        """Interpolated data_gb and price_sgd of each duration, NaN where valid is False."""
+        durations = np.asarray(durations, dtype=np.float64)
+        n_durations = len(self.durations)
+        low = np.searchsorted(self.durations, durations, side='left') - 1
+        high = np.searchsorted(self.durations, durations, side='right')
+        valid = (low >= 0) & (high < n_durations)
+
+        result = {'valid': valid}
+        if not n_durations:
+            for field in CURVE_FIELDS:
+                result[field] = np.full(durations.shape, np.nan)
+            return result
+
+        low, high = np.clip(low, 0, n_durations - 1), np.clip(high, 0, n_durations - 1)
+        x0, x1 = self.durations[low], self.durations[high]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = (durations - x0) / (x1 - x0)
+            for field in CURVE_FIELDS:
+                y0, y1 = self.values[field][low], self.values[field][high]
+                values = np.where(valid, y0 + fraction * (y1 - y0), np.nan)
+                result[field] = self._round(values) if rounded else values
+        return result
+
+    def interpolate_plan(self, duration, zone: int) -> Optional[dict]:
+        interpolated = self.interpolate([duration])
+        if not interpolated['valid'][0]:
+            return None
+        return {
+            'zone': zone,
+            'duration_days': duration,
+            'data_gb': float(interpolated['data_gb'][0]),
+            'price_sgd': float(interpolated['price_sgd'][0]),
+            'id': -1  # synthetic
+        }
+
+    @staticmethod
+    def _round(values: np.ndarray) -> np.ndarray:
+        # builtin round() rather than np.round(), which scales by 10 ** decimals and can round halves differently
+        return np.fromiter(
+            (round(v, ROUND_DECIMALS) if v == v else v for v in values.tolist()),
+            dtype=np.float64, count=values.size
+        ).reshape(values.shape)
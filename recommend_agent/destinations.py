@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""in-memory destination name index for resolving user supplied destinations to zones
+
+DestinationIndex.load()
+
+  - reads country and zone from the destination table and the aliases of data/destination_alias.csv
+  - exact lookups are a single dict probe on the normalized name, in order of priority
+    - canonical country name ("Korea, Republic of")
+    - alias ("UAE", "S. Korea", "KL")
+    - short form of an ISO style name ("Bolivia"), unless it is shared by two countries
+  - names are normalized by case and accent folding and by dropping punctuation, "S. Korea" -> "s korea"
+  - misses fall back to a character trigram index over all indexed names, the names sharing enough
+    trigrams are checked with a bounded Levenshtein distance, one edit per 4 characters of the query
+    and at most max_edit_distance
+  - candidates() returns the ranked fuzzy matches
+    {
+        "country": <canonical country name>,
+        "zone": <zone>,
+        "name": <indexed name that matched>,
+        "match": <exact | alias | short_name | fuzzy>,
+        "distance": <edit distance>,
+        "confidence": <1 - distance / name length>
+    }
+  - resolve() returns the best match, fuzzy matches only when the query has at least FUZZY_MIN_LENGTH characters,
+    no other country is as close and the query is not the start or a whole word of another country's name,
+    short real place names are too often one edit from a country ("Nice" is not Niue, "Sedan" is not Sudan)
+    - otherwise it returns None and candidates() offers the matches for confirmation
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from typing import Optional
+from base import BaseHandler
+from .gazetteer import TOKEN_PATTERN, fold, load_aliases, name_variants
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+SQL_DESTINATIONS = "SELECT country, zone FROM destination"
+MAX_EDIT_DISTANCE_DEFAULT = 2
+CHARS_PER_EDIT = 4
+NGRAM_SIZE = 3
+CANDIDATES_DEFAULT = 5
+FUZZY_MIN_LENGTH = 6
+FUZZY_CACHE_SIZE = 4096
+MATCH_PRIORITY = {'short_name': 0, 'alias': 1, 'exact': 2}
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def normalize_name(name: str) -> str:
+    return ' '.join(TOKEN_PATTERN.findall(fold(name)))
+
+
+def ngrams(name: str) -> list[str]:
+    padded = f'  {name}  '
+    return [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance of a and b, or max_distance + 1 as soon as it is known to exceed max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class NGramIndex:
+    """Character trigram postings over the indexed names.
+
+    An edit changes at most 3 trigrams of the padded name, so a name within distance d of the query shares
+    at least len(query) + 2 - 3d trigrams with it. Only names passing that count are checked with edit_distance().
+    """
+
+    def __init__(self):
+        self.postings: dict[str, list[str]] = {}
+
+    def add(self, name: str):
+        for gram in set(ngrams(name)):
+            self.postings.setdefault(gram, []).append(name)
+
+    def query(self, name: str, max_distance: int) -> list[tuple[int, str]]:
+        grams = ngrams(name)
+        shared = {}
+        for gram in set(grams):
+            for indexed_name in self.postings.get(gram, []):
+                shared[indexed_name] = shared.get(indexed_name, 0) + 1
+        min_shared = len(grams) - NGRAM_SIZE * max_distance
+        matches = []
+        for indexed_name, count in shared.items():
+            if count >= min_shared:
+                distance = edit_distance(name, indexed_name, max_distance)
+                if distance <= max_distance:
+                    matches.append((distance, indexed_name))
+        return sorted(matches)
+
+
+class DestinationIndex(BaseHandler):
+    def __init__(self, alias_file='', max_edit_distance=None):
+        self.alias_file: str = alias_file
+        self.max_edit_distance: int = MAX_EDIT_DISTANCE_DEFAULT if max_edit_distance is None else max_edit_distance
+        self.zones: dict[str, int] = {}
+        self._names: dict[str, tuple[str, str]] = {}
+        self._ngrams = NGramIndex()
+        self._fuzzy_cache: dict[str, list[dict]] = {}
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self.zones)} destinations [{self.status()}]>'
+
+    def loaded(self):
+        return self._status_code == 1
+
+    def exit(self):
+        pass
+
+    def load(self, db) -> bool:
+        """Indexes the destination table of a connected DBConnector and the alias file. Returns True on success."""
+        try:
+            rows = db.execute(SQL_DESTINATIONS, re_raise=True)
+        except Exception as e:
+            self._exception_handle(msg='failed to load destination index', exception=e, is_fatal=False)
+            return False
+        self.build([(country, zone) for country, zone in rows], load_aliases(self.alias_file))
+        return True
+
+    def build(self, destinations: list[tuple[str, int]], aliases: dict[str, str]):
+        self.zones = {country: zone for country, zone in destinations}
+        names = {}
+        shared_short_names = set()
+
+        def add(name, country, match):
+            key = normalize_name(name)
+            if not key:
+                return
+            if key in names and match == 'short_name' and names[key][0] != country:
+                shared_short_names.add(key)
+            if key not in names or MATCH_PRIORITY[match] >= MATCH_PRIORITY[names[key][1]]:
+                names[key] = (country, match)
+
+        for country in self.zones:
+            for variant in name_variants(country) - {country}:
+                add(variant, country, 'short_name')
+        for alias, country in aliases.items():
+            if country in self.zones:
+                add(alias, country, 'alias')
+        for country in self.zones:
+            add(country, country, 'exact')
+
+        self._names = {
+            key: entry for key, entry in names.items()
+            if not (key in shared_short_names and entry[1] == 'short_name')
+        }
+        self._ngrams = NGramIndex()
+        for key in self._names:
+            self._ngrams.add(key)
+        self._fuzzy_cache = {}
+        self._status_code = 1
+        self.error = ''
+
+    def destinations(self) -> dict[str, str]:
+        """Lookup dict mapping lowercase country names to canonical country names."""
+        return {country.lower(): country for country in self.zones}
+
+    def lookup(self, name: str) -> Optional[dict]:
+        """Exact or alias match, None on a miss."""
+        key = normalize_name(name)
+        entry = self._names.get(key)
+        if entry is None:
+            return None
+        country, match = entry
+        return self._match(country, key, match, 0)
+
+    def candidates(self, name: str, limit=None) -> list[dict]:
+        """Ranked fuzzy matches within the edit distance bound, one per country."""
+        key = normalize_name(name)
+        ranked = self._fuzzy_cache.get(key)
+        if ranked is None:
+            if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.clear()
+            max_distance = min(self.max_edit_distance, len(key) // CHARS_PER_EDIT)
+            ranked, seen = [], set()
+            for distance, matched_key in self._ngrams.query(key, max_distance) if max_distance else []:
+                country, _ = self._names[matched_key]
+                if country not in seen:
+                    seen.add(country)
+                    ranked.append(self._match(country, matched_key, 'fuzzy', distance))
+            self._fuzzy_cache[key] = ranked
+        return [dict(c) for c in ranked[:limit or CANDIDATES_DEFAULT]]
+
+    def resolve(self, name: str) -> Optional[dict]:
+        """Best match for name, a fuzzy match only if the name is long enough, strictly closer to it than to any
+        other country and not part of another country's name, None when not found or ambiguous."""
+        match = self.lookup(name)
+        if match is not None:
+            return match
+        if len(normalize_name(name)) < FUZZY_MIN_LENGTH:
+            return None
+        candidates = self.candidates(name, limit=2)
+        if not candidates:
+            return None
+        if len(candidates) > 1 and candidates[1]['distance'] == candidates[0]['distance']:
+            return None
+        if self.containing(name) - {candidates[0]['country']}:
+            return None
+        return candidates[0]
+
+    def suggestions(self, name: str) -> list[str]:
+        """Countries to confirm with the user when resolve() returns None, the fuzzy candidates first,
+        then the countries whose names contain name."""
+        countries = [c['country'] for c in self.candidates(name)]
+        return countries + sorted(self.containing(name) - set(countries))
+
+    def containing(self, name: str) -> set[str]:
+        """Countries with an indexed name that starts with name or contains it as whole words."""
+        key = normalize_name(name)
+        if not key:
+            return set()
+        padded = f' {key} '
+        return {
+            country for indexed_name, (country, _) in self._names.items()
+            if indexed_name.startswith(key) or padded in f' {indexed_name} '
+        }
+
+    def zone(self, name: str) -> Optional[int]:
+        match = self.resolve(name)
+        return match['zone'] if match else None
+
+    def _match(self, country: str, key: str, match: str, distance: int) -> dict:
+        return {
+            'country': country,
+            'zone': self.zones[country],
+            'name': key,
+            'match': match,
+            'distance': distance,
+            'confidence': round(1 - distance / max(len(key), 1), 3)
+        }
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""deterministic destination matcher used as a pre-filter in front of the LLM intent classifier
+
+DestinationGazetteer
+
+  - load() reads destination.country from the roaming plans database and adds the aliases of data/destination_alias.csv
+  - names are indexed in a word-level trie, with variants for ISO style names
+    ("Korea, Republic of" -> "Korea", "Cocos (Keeling) Islands" -> "Cocos Islands") and accent folding
+  - match() scans the input once and returns the longest destination phrase at each position
+  - classify() returns a relevance result on a confident match, or None so that the input goes to the LLM
+    - uppercase aliases (KL, UK, USA) only match uppercase tokens
+    - two-letter aliases (KL, UK, US) are also pronouns and abbreviations, they match as the whole input
+      or after a travel context word ("to the US"), not in "Tell US a joke"
+    - names that are also common words or brands (Turkey, Chile, Canada, DC) are ambiguous,
+      they only match after a travel context word ("trip to Turkey")
+    - everything else goes to the LLM
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import csv
+import re
+import unicodedata
+from typing import Optional
+from base import BaseHandler
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+SQL_COUNTRIES = "SELECT country FROM destination"
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+DESTINATION_ALIASES_PATH = 'data/destination_alias.csv'
+AMBIGUOUS_NAMES = {
+    'canada', 'chad', 'chile', 'china', 'congo', 'dc', 'georgia', 'guinea', 'jersey', 'jordan', 'panama', 'reunion',
+    'turkey'
+}
+TRAVEL_CONTEXT_WORDS = {'to', 'into', 'via', 'visit', 'visiting'}
+CONTEXT_SKIP_WORDS = {'the'}
+MATCH_SCORE = 1.0
+_END = None
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def fold(text: str) -> str:
+    """Casefolds and strips accents so that 'Åland' and 'aland' compare equal."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> list[str]:
+    """Word tokens, uppercase acronyms are kept as-is and every other token is folded."""
+    return [t if t.isupper() and len(t) <= 3 else fold(t) for t in TOKEN_PATTERN.findall(text)]
+
+
+def load_aliases(filepath='') -> dict[str, str]:
+    """alias -> country from the alias CSV file, empty if the file cannot be read."""
+    try:
+        with open(filepath or DESTINATION_ALIASES_PATH, newline='', encoding='utf-8') as f:
+            return {row['alias']: row['country'] for row in csv.DictReader(f)}
+    except OSError:
+        return {}
+
+
+def name_variants(country: str) -> set[str]:
+    variants = {country}
+    base_name = country.split(',')[0]
+    variants.add(base_name)
+    variants.update(re.sub(r'\s*\([^)]*\)', '', v) for v in list(variants))
+    return {v.strip() for v in variants if v.strip()}
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class DestinationGazetteer(BaseHandler):
+    def __init__(self, aliases: Optional[dict] = None, ambiguous: Optional[set] = None):
+        self.aliases: dict[str, str] = load_aliases() if aliases is None else aliases
+        self.ambiguous: set[str] = AMBIGUOUS_NAMES if ambiguous is None else ambiguous
+        self._trie: dict = {}
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} [{self.status()}]>'
+
+    def loaded(self):
+        return self._status_code == 1
+
+    def exit(self):
+        pass
+
+    def load(self, db) -> bool:
+        """Indexes the destination countries of a DBConnector and the aliases. Returns True on success."""
+        if not db.connect():
+            self._exception_handle(msg=f'failed to load destinations. {db.error}', is_fatal=False)
+            return False
+        try:
+            rows = db.execute(SQL_COUNTRIES, re_raise=True)
+        except Exception as e:
+            self._exception_handle(msg='failed to load destinations', exception=e, is_fatal=False)
+            return False
+        self.build([country for (country,) in rows])
+        return True
+
+    def build(self, countries: list[str]):
+        self._trie = {}
+        for country in countries:
+            for variant in name_variants(country):
+                self.add(variant, country)
+        for alias, country in self.aliases.items():
+            self.add(alias, country)
+        self._status_code = 1
+        self.error = ''
+
+    def add(self, name: str, country: str):
+        node = self._trie
+        for token in tokenize(name):
+            node = node.setdefault(token, {})
+        node.setdefault(_END, set()).add(country)
+
+    def match(self, text: str) -> list[tuple[str, set[str]]]:
+        """Longest (phrase, countries) matches in text, left to right."""
+        tokens = tokenize(text)
+        return [(' '.join(tokens[start:end]), countries) for start, end, countries in self._spans(tokens)]
+
+    def _spans(self, tokens: list[str]) -> list[tuple[int, int, set[str]]]:
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node, longest = self._trie, None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                if _END in node:
+                    longest = (j + 1, node[_END])
+            if longest:
+                end, countries = longest
+                matches.append((i, end, countries))
+                i = end
+            else:
+                i += 1
+        return matches
+
+    def classify(self, user_input: str) -> Optional[dict]:
+        """Returns {"reason", "score"} when the input names a destination unambiguously, otherwise None."""
+        tokens = tokenize(user_input)
+        confident = [
+            (' '.join(tokens[start:end]), countries) for start, end, countries in self._spans(tokens)
+            if self._confident(tokens, start, end)
+        ]
+        if not confident:
+            return None
+        phrase, countries = confident[0]
+        return {
+            "reason": f"Local rule matched destination '{phrase}' ({', '.join(sorted(countries))}).",
+            "score": MATCH_SCORE
+        }
+
+    def _confident(self, tokens: list[str], start: int, end: int) -> bool:
+        phrase = ' '.join(tokens[start:end])
+        if fold(phrase) in self.ambiguous:
+            return self._travel_context(tokens, start)
+        if len(phrase) == 2 and phrase.isupper():
+            return end - start == len(tokens) or self._travel_context(tokens, start)
+        return True
+
+    @staticmethod
+    def _travel_context(tokens: list[str], start: int) -> bool:
+        """True if the phrase at start follows a travel context word, as in 'flying to the US'."""
+        i = start - 1
+        while i >= 0 and tokens[i] in CONTEXT_SKIP_WORDS:
+            i -= 1
+        return i >= 0 and tokens[i] in TRAVEL_CONTEXT_WORDS
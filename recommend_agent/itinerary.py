@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""minimum-cost roaming plans for a multi-leg trip
+
+solve_itinerary(), used by RoamingPlanRecommender.optimize_itinerary()
+
+  - takes inputs
+    - legs: trip legs in travel order, each {"zone", "duration_days", "service_type", "data_needed_gb", "usage"}
+      and optionally "destination"
+    - plans: roaming plans of the legs' zones {"zone", "duration_days", "data_gb", "price_sgd"}
+    - rates: zone -> pay-per-use rates
+
+  - the legs are laid out as consecutive trip days, each day in the zone of its leg with an equal share of the
+    leg's data need, data legs without data_needed_gb need DATA_GB_PER_DAY_DEFAULT per day
+  - a plan covers the days of its own zone from the day it is bought until its duration runs out,
+    so one plan can span consecutive legs, or legs either side of a stay in another zone
+    - the covered days share the plan's data, data beyond it is charged at the zone's pay-per-use data rate
+    - days not covered by a plan pay for all their data at the pay-per-use data rate
+  - plans of different zones never cover the same day, so each zone is solved on its own by dynamic programming
+    over its days: cost[i] is the cheapest cover of the zone's first i days, reached either by a pay-per-use day
+    or by a plan bought on a zone day and used for the next zone days within its duration
+    - O(days x plans x plan duration) per trip instead of enumerating every combination of plans
+  - call minutes and SMS are charged at pay-per-use rates as in scoring.py, they do not depend on the plans
+
+  - returns
+    {
+        "total_sgd": <plan prices + data overage + pay-per-use data, calls and SMS>,
+        "purchases": [
+            {
+                "zone", "duration_days", "data_gb", "price_sgd": <the plan>,
+                "first_day": <trip day the plan is bought, from 1>,
+                "last_day": <last trip day of the plan's validity, may be after the trip>,
+                "days_used": <days of the plan's zone covered>,
+                "overage_sgd": <data beyond the plan's data_gb at the pay-per-use rate>
+            }
+        ],
+        "legs": [
+            {
+                "destination", "zone", "duration_days", "service_type", "data_needed_gb": <the leg>,
+                "first_day", "last_day": <trip days of the leg>,
+                "plans": [<purchases covering days of the leg>],
+                "pay_per_use_days": <days of the leg without a plan>,
+                "pay_per_use_data_sgd": <data cost of those days>,
+                "usage_sgd": <calls and SMS at pay-per-use rates>
+            }
+        ]
+    }
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import bisect
+from .scoring import DATA_RATE_UNIT_KB, KB_PER_GB, SERVICE_TYPES, trip_usage, usage_cost
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+DATA_GB_PER_DAY_DEFAULT = 1.0
+COST_EPSILON = 1e-9
+MONEY_DECIMALS = 2
+PLAN_KEYS = ['zone', 'duration_days', 'data_gb', 'price_sgd']
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def whole_days(duration_days) -> bool:
+    return isinstance(duration_days, int) and not isinstance(duration_days, bool) and duration_days >= 1
+
+
+def leg_data_gb(leg: dict) -> float:
+    if leg.get('data_needed_gb') is not None:
+        return float(leg['data_needed_gb'])
+    return DATA_GB_PER_DAY_DEFAULT * leg['duration_days'] if leg['service_type'] == 'data' else 0.0
+
+
+def data_rate_per_gb(rates: dict) -> float:
+    return (rates.get('rate_data_per_10kb') or 0.0) * KB_PER_GB / DATA_RATE_UNIT_KB
+
+
+def distinct_plans(plans: list[dict]) -> list[dict]:
+    """One plan per (zone, duration_days, data_gb, price_sgd), identical plans are interchangeable."""
+    seen = {}
+    for plan in plans:
+        seen.setdefault(tuple(plan[k] for k in PLAN_KEYS), {k: plan[k] for k in PLAN_KEYS})
+    return sorted(seen.values(), key=lambda p: (p['zone'], p['duration_days'], p['price_sgd'], -p['data_gb']))
+
+
+def zone_cover(days: list[int], need_gb: list[float], plans: list[dict], rate_per_gb: float) -> tuple[float, list]:
+    """
+    Cheapest cover of the days of one zone, days are ascending trip day indices and need_gb their data need.
+    Returns the cost and the chosen blocks (start position, end position, plan or None for pay-per-use).
+    """
+    n = len(days)
+    prefix = [0.0]
+    for gb in need_gb:
+        prefix.append(prefix[-1] + gb)
+    cost = [0.0] + [float('inf')] * n
+    choice = [None] * (n + 1)
+    for i in range(n):
+        if cost[i] == float('inf'):
+            continue
+        ppu = cost[i] + need_gb[i] * rate_per_gb
+        if ppu < cost[i + 1] - COST_EPSILON:
+            cost[i + 1], choice[i + 1] = ppu, (i, None)
+        for plan in plans:
+            # zone days within the plan's validity, a plan may be used for fewer of them
+            last = bisect.bisect_left(days, days[i] + plan['duration_days'], lo=i)
+            for j in range(i + 1, last + 1):
+                overage_gb = max(prefix[j] - prefix[i] - plan['data_gb'], 0.0)
+                block = cost[i] + plan['price_sgd'] + overage_gb * rate_per_gb
+                if block < cost[j] - COST_EPSILON:
+                    cost[j], choice[j] = block, (i, plan)
+
+    blocks, j = [], n
+    while j > 0:
+        i, plan = choice[j]
+        blocks.append((i, j, plan))
+        j = i
+    return cost[n], blocks[::-1]
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def solve_itinerary(legs: list[dict], plans: list[dict], rates: dict[int, dict]) -> dict:
+    """Minimum-cost plans and pay-per-use usage for the legs, see the module docstring. Raises ValueError
+    for legs with a service type outside SERVICE_TYPES, a duration that is not a positive whole number of days,
+    or a zone without rates."""
+    day_zones, day_need, leg_days = [], [], []
+    for n, leg in enumerate(legs):
+        if leg['service_type'] not in SERVICE_TYPES:
+            raise ValueError(f"unsupported service type: {leg['service_type']}. Allowed {SERVICE_TYPES}")
+        duration_days = leg['duration_days']
+        if not whole_days(duration_days):
+            raise ValueError(f'invalid duration for leg {n + 1}: {duration_days!r}, expected whole days >= 1')
+        if not rates.get(leg['zone']):
+            raise ValueError(f"no rates found for zone {leg['zone']}")
+        first_day = len(day_zones)
+        leg_days.append((first_day, first_day + duration_days))
+        day_zones.extend([leg['zone']] * duration_days)
+        day_need.extend([leg_data_gb(leg) / duration_days] * duration_days)
+
+    zone_plans = {}
+    for plan in distinct_plans(plans):
+        zone_plans.setdefault(plan['zone'], []).append(plan)
+
+    purchases, day_purchase, day_ppu_sgd = [], [None] * len(day_zones), [0.0] * len(day_zones)
+    data_sgd = 0.0
+    for zone in sorted(set(day_zones)):
+        days = [d for d, z in enumerate(day_zones) if z == zone]
+        need_gb = [day_need[d] for d in days]
+        rate_per_gb = data_rate_per_gb(rates[zone])
+        zone_sgd, blocks = zone_cover(days, need_gb, zone_plans.get(zone, []), rate_per_gb)
+        data_sgd += zone_sgd
+        for i, j, plan in blocks:
+            if plan is None:
+                day_ppu_sgd[days[i]] = need_gb[i] * rate_per_gb
+                continue
+            overage_gb = max(sum(need_gb[i:j]) - plan['data_gb'], 0.0)
+            purchase = {
+                **plan,
+                'first_day': days[i] + 1,
+                'last_day': days[i] + plan['duration_days'],
+                'days_used': j - i,
+                'overage_sgd': round(overage_gb * rate_per_gb, MONEY_DECIMALS)
+            }
+            purchases.append(purchase)
+            for d in days[i:j]:
+                day_purchase[d] = purchase
+    purchases.sort(key=lambda p: p['first_day'])
+
+    leg_results, usage_sgd = [], 0.0
+    for leg, (start, stop) in zip(legs, leg_days):
+        leg_usage_sgd = usage_cost(trip_usage(leg), rates[leg['zone']])
+        usage_sgd += leg_usage_sgd
+        covering = []
+        for d in range(start, stop):
+            if day_purchase[d] is not None and day_purchase[d] not in covering:
+                covering.append(day_purchase[d])
+        leg_results.append({
+            'destination': leg.get('destination'),
+            'zone': leg['zone'],
+            'duration_days': leg['duration_days'],
+            'service_type': leg['service_type'],
+            'data_needed_gb': leg.get('data_needed_gb'),
+            'first_day': start + 1,
+            'last_day': stop,
+            'plans': [dict(p) for p in covering],
+            'pay_per_use_days': sum(day_purchase[d] is None for d in range(start, stop)),
+            'pay_per_use_data_sgd': round(sum(day_ppu_sgd[start:stop]), MONEY_DECIMALS),
+            'usage_sgd': round(leg_usage_sgd, MONEY_DECIMALS)
+        })
+
+    return {
+        'total_sgd': round(data_sgd + usage_sgd, MONEY_DECIMALS),
+        'purchases': purchases,
+        'legs': leg_results
+    }
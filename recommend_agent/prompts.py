@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""prompt compiler for the LLM intent classifier
+
+PromptCompiler
+
+  - holds the few-shot examples as structured data
+    {"user": <example input>, "reasoning": <one sentence>, "score": <relevance 0.0 - 1.0>}
+  - drops duplicate examples, the first example for an input wins
+  - indexes the examples by word and character trigram TF-IDF vectors
+  - compile() builds the system prompt for one request with the preamble and only the k examples
+    most similar to the user input, in their original order
+  - score_first=True lists the score before the reasoning in each example, for the streaming score-first mode
+    {
+        "text": <system prompt>,
+        "token_count": <prompt tokens>,
+        "examples": <number of examples included>
+    }
+  - token counts use tiktoken when it is installed and its encoding is available, otherwise an estimate
+    of 4 characters per token
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import Optional
+from base import BaseHandler
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+FEW_SHOT_K_DEFAULT = 6
+CHARS_PER_TOKEN = 4
+TOKEN_ENCODING = 'cl100k_base'
+WORD_PATTERN = re.compile(r"\w+")
+
+# module variables ---------------------------------------------------------------------------------------------------
+_encoding = None
+_encoding_loaded = False
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def count_tokens(text: str) -> int:
+    """Prompt tokens of text, estimated from its length when tiktoken cannot be loaded."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def example_text(example: dict, score_first=False) -> str:
+    if score_first:
+        return (
+            f"User: {example['user']}\n"
+            f"Score: {example['score']}\n"
+            f"Reasoning: {example['reasoning']}\n\n"
+        )
+    return (
+        f"User: {example['user']}\n"
+        f"Reasoning: {example['reasoning']}\n"
+        f"Score: {example['score']}\n\n"
+    )
+
+
+def dedupe_examples(examples: list[dict]) -> list[dict]:
+    seen = set()
+    unique = []
+    for example in examples:
+        key = ' '.join(example['user'].split()).casefold()
+        if key not in seen:
+            seen.add(key)
+            unique.append(example)
+    return unique
+
+
+def lexical_terms(text: str) -> Counter:
+    """Words plus character trigrams of each word, so that misspellings still share terms."""
+    terms = Counter()
+    for word in WORD_PATTERN.findall(text.casefold()):
+        terms[f'w:{word}'] += 1
+        padded = f' {word} '
+        terms.update(f'c:{padded[i:i + 3]}' for i in range(len(padded) - 2))
+    return terms
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class PromptCompiler(BaseHandler):
+    def __init__(self, preamble: str, examples: list[dict], k=None, score_first=False):
+        self.preamble: str = preamble
+        self.examples: list[dict] = dedupe_examples(examples)
+        self.k: int = k or FEW_SHOT_K_DEFAULT
+        self.score_first: bool = score_first
+        self.requests = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+        self._index_build()
+        self._fingerprint = self._fingerprint_hash()
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self.examples)} examples, k={self.k}>'
+
+    def exit(self):
+        pass
+
+    def _index_build(self):
+        documents = [lexical_terms(e['user']) for e in self.examples]
+        document_frequency = Counter(term for terms in documents for term in terms)
+        n_documents = len(documents)
+        self._idf = {
+            term: math.log((1 + n_documents) / (1 + df)) + 1
+            for term, df in document_frequency.items()
+        }
+        self._vectors = [self._vector(terms) for terms in documents]
+
+    def _vector(self, terms: Counter) -> dict[str, float]:
+        vector = {t: n * self._idf[t] for t, n in terms.items() if t in self._idf}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {t: w / norm for t, w in vector.items()} if norm else {}
+
+    def similar(self, user_input: str, k=None) -> list[int]:
+        """Positions of the k examples most similar to the input, in their original order."""
+        k = k or self.k
+        if k >= len(self.examples):
+            return list(range(len(self.examples)))
+        query = self._vector(lexical_terms(user_input))
+        similarity = [
+            sum(w * vector.get(t, 0.0) for t, w in query.items())
+            for vector in self._vectors
+        ]
+        ranked = sorted(range(len(self.examples)), key=lambda i: (-similarity[i], i))
+        return sorted(ranked[:k])
+
+    def compile(self, user_input: Optional[str] = None, k=None) -> dict:
+        """The system prompt for one request, every example is included when user_input is None."""
+        if user_input is None:
+            positions = range(len(self.examples))
+        else:
+            positions = self.similar(user_input, k=k)
+        text = self.preamble + ''.join(example_text(self.examples[i], self.score_first) for i in positions)
+        token_count = count_tokens(text)
+        with self._lock:
+            self.requests += 1
+            self.total_tokens += token_count
+        return {
+            'text': text,
+            'token_count': token_count,
+            'examples': len(positions)
+        }
+
+    def fingerprint(self) -> str:
+        """Hash of the preamble, examples, k and example format, so that prompt changes miss the response cache."""
+        return self._fingerprint
+
+    def _fingerprint_hash(self) -> str:
+        config_json = json.dumps([self.preamble, self.examples, self.k, self.score_first], sort_keys=True)
+        return hashlib.sha256(config_json.encode('utf-8')).hexdigest()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'total_tokens': self.total_tokens,
+                'mean_tokens': self.total_tokens / self.requests if self.requests else 0.0
+            }
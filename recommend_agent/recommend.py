@@ -8,6 +8,9 @@ RoamingPlanRecommender.recommend()
     - trip duration: number of days
     - service type: [data, sms, calls]
     - data needed: amount of data needed in GB
+    - usage: optional trip totals {call_minutes_outgoing, call_minutes_incoming, sms}
+
+  - ranks candidate plans by expected total trip cost, see scoring.py for the registered strategies
 
   - returns results as a JSON row from the roaming plan database
     {
@@ -20,30 +23,189 @@ RoamingPlanRecommender.recommend()
         "rate_calls_incoming_per_min": <rate $ per min>,
         "rate_per_sms": <rate $ per SMS>
     }
+
+  - a destination resolved by a fuzzy match adds "country": <resolved country> and "match": "fuzzy" to every row
+
+  - failures return [{"error": <message>, "code": <code>}], see RecommendationError
+    - misses, the ordinary outcomes of user input, keep the database connection open
+      no_zone, ambiguous_destination with "candidates": [<countries to confirm>], no_plans, no_rates,
+      unsupported_service_type, and invalid_duration for itinerary legs
+    - faults are failures of the recommender itself
+      unavailable and database close the connection so that the next request reconnects, internal does not
+  - stats() counts the misses, faults, opened connections and reconnects
+
+  - snapshot mode RoamingPlanRecommender(snapshot=True)
+    - loads the plan, ppu_rate and destination tables once into an in-memory PlanCatalog
+    - answers recommend() and get_destinations() from memory without per-request SQL
+    - catalog_load(refresh=True) reloads the snapshot from the database
+
+  - compiled catalog mode RoamingPlanRecommender(catalog_path='plans.catalog')
+    - maps the binary catalog written by db_build(compile_catalog=True), see compiled.py,
+      and answers like snapshot mode without opening the database
+    - loading takes the same time for any catalog size, the materialized table is not used
+
+  - destinations are resolved by an in-memory DestinationIndex, see destinations.py
+    - exact names and the aliases of data/destination_alias.csv in one dict lookup
+    - misspelled names by bounded edit distance ("Malaysa" -> Malaysia), short or ambiguous names
+      ("Nice", "Dominican") return the ambiguous_destination miss with the candidates instead
+
+RoamingPlanRecommender.recommend_many()
+
+  - takes a list or DataFrame of trips with the recommend() inputs
+  - groups the trips by zone and interpolates and scores the candidates with NumPy array operations
+  - scores from the catalog snapshot also in database mode, reloading it when the database was rebuilt
+  - durations between two plan durations are interpolated on the zone's PlanCurve, see curves.py
+  - returns the recommend() shortlist for each trip, in input order
+
+RoamingPlanRecommender.optimize_itinerary()
+
+  - takes the legs of a multi-destination trip in travel order, as dicts with the recommend() inputs
+    or (destination, duration_days, service_type, data_needed_gb) tuples
+  - finds the cheapest mix of zone plans and pay-per-use usage over all legs, a plan may cover several legs
+    of its zone, see itinerary.py for the dynamic program and the returned itinerary
+
+  - materialized mode RoamingPlanRecommender(materialized=True)
+    - db_build(materialize=True) precomputes the ranked shortlist of every (zone, duration_days 1-30, service_type)
+      request with default usage into the recommendation table
+    - such requests are answered by the destination lookup plus one keyed fetch, others are computed live
+    - the table is only used while it matches the build hashes of the plan and ppu_rate tables
+
+python -m recommend_agent.recommend --verify-query-plans --verify-materialized
+
+  - runs EXPLAIN QUERY PLAN on the per-request queries and exits 1 if any of them does a full scan
+  - compares every materialized shortlist with the live computation and exits 1 on any difference
 """
 # dependencies -------------------------------------------------------------------------------------------------------
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
 from typing import Optional
+import numpy as np
 from .roaming_plans import DBConnector
-from base import BaseHandler
+from .catalog import PlanCatalog
+from .compiled import source_hash
+from .curves import PlanCurve
+from .destinations import DestinationIndex
+from .gazetteer import load_aliases
+from .itinerary import solve_itinerary, whole_days
+from .roaming_plans import BUILD_META_TABLE
+from .scoring import (
+    SCORING_MODEL_VERSION, SCORING_STRATEGY_DEFAULT, SERVICE_TYPES, get_scoring_strategy, score_plans, score_plans_many
+)
+from base import BaseHandler, instrumented
 
 
 # constants -------------------------------------------------------------------------------------------------------
 SHORTLIST_NUM_DEFAULT = 3
 LARGE_GB = 1000
-SERVICE_TYPES = [
-    'data',
-    'calls',
-    'sms'
-]
+SQL_ZONE_FOR_DESTINATION = "SELECT zone FROM destination WHERE lower(country) = ?"
+SQL_RATES_FOR_ZONE = "SELECT rate_data_per_10kb, rate_calls_outgoing_per_min, rate_calls_incoming_per_min, rate_per_sms FROM ppu_rate WHERE zone = ?"
+SQL_PLANS_FOR_ZONE = "SELECT * FROM plan WHERE zone = ?"
+SQL_DESTINATIONS = "SELECT country FROM destination"
+MATERIALIZED_TABLE = 'recommendation'
+MATERIALIZED_MAX_DURATION_DAYS = 30
+MATERIALIZED_SHORTLIST_NUM = 10
+MATERIALIZED_SOURCE_TABLES = ['plan', 'ppu_rate']
+SQL_MATERIALIZED_CREATE = f"""CREATE TABLE {MATERIALIZED_TABLE} (
+    zone INTEGER NOT NULL,
+    duration_days INTEGER NOT NULL,
+    service_type TEXT NOT NULL,
+    shortlist TEXT NOT NULL,
+    PRIMARY KEY (zone, duration_days, service_type)
+);"""
+SQL_MATERIALIZED_FETCH = (
+    f"SELECT shortlist FROM {MATERIALIZED_TABLE} WHERE zone = ? AND duration_days = ? AND service_type = ?"
+)
+SQL_MATERIALIZED_ALL = f"SELECT zone, duration_days, service_type, shortlist FROM {MATERIALIZED_TABLE}"
+# per-request queries with their table and sample arguments, each must be answered by an index search rather than a scan.
+# SQL_DESTINATIONS reads the whole table on purpose and is not listed
+LOOKUP_QUERIES = {
+    'zone_for_destination': ('destination', SQL_ZONE_FOR_DESTINATION, ('japan',)),
+    'rates_for_zone': ('ppu_rate', SQL_RATES_FOR_ZONE, (1,)),
+    'plans_for_zone': ('plan', SQL_PLANS_FOR_ZONE, (1,)),
+    'materialized_shortlist': (MATERIALIZED_TABLE, SQL_MATERIALIZED_FETCH, (1, 7, 'data'))
+}
+
+ERROR_NO_ZONE = 'no_zone'
+ERROR_AMBIGUOUS_DESTINATION = 'ambiguous_destination'
+ERROR_NO_PLANS = 'no_plans'
+ERROR_NO_RATES = 'no_rates'
+ERROR_SERVICE_TYPE = 'unsupported_service_type'
+ERROR_DURATION = 'invalid_duration'
+ERROR_UNAVAILABLE = 'unavailable'
+ERROR_DATABASE = 'database'
+ERROR_INTERNAL = 'internal'
+MISS_CODES = [ERROR_NO_ZONE, ERROR_AMBIGUOUS_DESTINATION, ERROR_NO_PLANS, ERROR_NO_RATES, ERROR_SERVICE_TYPE, ERROR_DURATION]
 
 # module variables -------------------------------------------------------------------------------------------------
 
 
+# helper functions ---------------------------------------------------------------------------------------------------
+def is_database_error(exception: Exception) -> bool:
+    """True for sqlite3 errors, also when re-raised by DBConnector as the cause of a RuntimeError."""
+    return isinstance(exception, sqlite3.Error) or isinstance(exception.__cause__, sqlite3.Error)
+
+
 # classes ------------------------------------------------------------------------------------------------------------
+class RecommendationError(Exception):
+    """Failed recommendation with a machine readable code, returned to callers by result()."""
+    fatal = False
+
+    def __init__(self, code: str, message: str):
+        self.code = code
+        self.message = message
+        super().__init__(message)
+
+    def result(self) -> list[dict]:
+        return [{'error': self.message, 'code': self.code}]
+
+
+class RecommendationMiss(RecommendationError):
+    """Ordinary lookup miss, such as an unknown destination, that leaves the recommender and its connection usable.
+    candidates are the destinations to confirm with the user."""
+
+    def __init__(self, code: str, message: str, candidates: Optional[list[str]] = None):
+        super().__init__(code, message)
+        self.candidates = candidates
+
+    def result(self) -> list[dict]:
+        result = super().result()
+        if self.candidates:
+            result[0]['candidates'] = list(self.candidates)
+        return result
+
+
+class RecommendationFault(RecommendationError):
+    """Failure of the recommender itself, fatal faults close the database connection."""
+
+    def __init__(self, code: str, message: str, fatal=False):
+        super().__init__(code, message)
+        self.fatal = fatal
+
+
 class RoamingPlanRecommender(BaseHandler):
-    def __init__(self, shortlist_num=None):
-        self.db = DBConnector()
+    def __init__(self, shortlist_num=None, snapshot=False, scoring_strategy=None, read_only=False, materialized=False,
+                 catalog_path=''):
+        self.read_only: bool = read_only
+        self.db = DBConnector(read_only=read_only)
         self.recommend_shortlist_num: int = shortlist_num or SHORTLIST_NUM_DEFAULT
+        self.scoring_strategy: Optional[str] = scoring_strategy
+        self.catalog_path: str = catalog_path
+        self.snapshot: bool = snapshot or bool(catalog_path)
+        self.catalog: Optional[PlanCatalog] = None
+        self._catalog_source: Optional[str] = None
+        self.destination_index: Optional[DestinationIndex] = None
+        self.materialized: bool = materialized
+        self._materialized_ready: Optional[bool] = None
+        self._materialized_shortlists: dict[tuple, list[dict]] = {}
+        self.misses = 0
+        self.faults = 0
+        self.reconnects = 0
+        self._lock = threading.Lock()
         super().__init__()
 
     def __repr__(self):
@@ -54,10 +216,15 @@ class RoamingPlanRecommender(BaseHandler):
         return super().status()
 
     def _status_update_from_db(self):
-        if self.db.status() == 'ERROR':
+        if self.db is None:
+            # dropped by exit() after a fatal fault, db_connect() opens a new connector
+            return
+        db_status = self.db.status()
+        if db_status == 'ERROR':
+            if self._status_code != 2:
+                self.error = f'{self.error} database error {self.db.error}'
             self._status_code = 2
-            self.error = f'{self.error} database error {self.db.error}'
-        elif self.db.status() == 'READY' and self._status_code == 1:
+        elif db_status == 'READY' and self._status_code == 1:
             self._status_code = 0
 
     def db_build(self):
@@ -76,149 +243,663 @@ class RoamingPlanRecommender(BaseHandler):
             self.db.close()
         return True
 
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'misses': self.misses,
+                'faults': self.faults,
+                'connections_opened': self.db.connections_opened if self.db else 0,
+                'reconnects': self.reconnects
+            }
+
     def db_connect(self):
-        if self.db is None:
-            self.db = DBConnector()
-        if self.db.connected():
-            return True
-        else:
+        reconnect = self.db is None
+        if reconnect:
+            # the connector is only dropped by exit() after a fatal fault
+            self.db = DBConnector(read_only=self.read_only)
+            with self._lock:
+                self.reconnects += 1
+        if not self.db.connected():
             self.db.connect()
-            if self.db.connected():
-                return True
-            else:
+            if not self.db.connected():
                 ex_msg = f'failed to connect to database. {self.db.error}'
                 self._exception_handle(msg=ex_msg)
                 return False
+        if reconnect:
+            # the fault that dropped the connector is over once a new connection is open
+            self._status_code = 0
+            self.error = ''
+        return True
+
+    def catalog_load(self, refresh=False):
+        """Loads the in-memory catalog snapshot from the database, or maps the compiled catalog,
+        once unless refresh is set."""
+        if self.catalog and self.catalog.loaded() and not refresh:
+            return True
+        catalog = PlanCatalog()
+        if self.catalog_path:
+            loaded = catalog.load_compiled(self.catalog_path)
+        elif self.db_connect():
+            loaded = catalog.load(self.db)
+        else:
+            return False
+        if loaded:
+            self.catalog = catalog
+            if refresh:
+                self.destination_index = None
+                self._materialized_ready = None
+            return True
+        else:
+            ex_msg = f'failed to load plan catalog snapshot. {catalog.error}'
+            self._exception_handle(msg=ex_msg)
+            return False
+
+    def _batch_catalog_load(self) -> bool:
+        """recommend_many() scores from the catalog snapshot also in database mode, there the snapshot is reloaded
+        whenever the build hashes of its source tables changed since it was loaded."""
+        if self.snapshot:
+            return self.catalog_load()
+        if not self.db_connect():
+            return False
+        current = source_hash(self.db)
+        if not self.catalog_load(refresh=self.catalog is not None and current != self._catalog_source):
+            return False
+        self._catalog_source = current
+        return True
 
+    def destination_index_load(self) -> Optional[DestinationIndex]:
+        """Loads the destination index once from the connected database or the compiled catalog,
+        None if it cannot be loaded."""
+        if self.destination_index is None or not self.destination_index.loaded():
+            destination_index = DestinationIndex()
+            if self._compiled_active():
+                destination_index.build(self.catalog.destination_rows(), load_aliases(destination_index.alias_file))
+            elif not destination_index.load(self.db):
+                return None
+            self.destination_index = destination_index
+        return self.destination_index
+
+    def source_connect(self):
+        if self.snapshot:
+            if self.db is None and not self.catalog_path:
+                # a fatal fault dropped the connector, the snapshot still serves if reconnecting fails
+                self.db_connect()
+            return self.catalog_load()
+        else:
+            return self.db_connect()
+
+    @instrumented('recommend')
     def recommend(
         self,
         destination: str,
         duration_days: int,
         service_type: str = "data",
-        data_needed_gb: float = None
+        data_needed_gb: float = None,
+        usage: Optional[dict] = None
     ) -> list[dict]:
 
-        if not self.db_connect():
-            ex_msg = f'problem connecting to roaming plan database {self.db.error}'
-            self._exception_handle(msg=ex_msg)
-            return [{'error': ex_msg}]
+        if not self.source_connect():
+            db_error = self.db.error if self.db else self.error
+            return self._error_result(RecommendationFault(
+                ERROR_UNAVAILABLE, f'problem connecting to roaming plan database {db_error}', fatal=True
+            ))
 
         try:
-            zone = self._get_zone_from_destination(destination)
-            if zone is None:
-                ex_msg = f'ERROR. no zone found for {destination}'
-                self._exception_handle(msg=ex_msg)
-                return [{'error': ex_msg}]
+            destination_match = self._destination_match(destination)
+            zone = destination_match['zone']
 
+            if self._materialized_applies(duration_days, service_type, data_needed_gb, usage):
+                shortlist = self._get_materialized_shortlist(zone, duration_days, service_type)
+                if shortlist is not None:
+                    return self._match_note(shortlist, destination_match)
 
             plans = self._get_all_plans_for_zone(zone)
             if not plans:
-                ex_msg = f'ERROR. no plans found for zone {zone}'
-                self._exception_handle(msg=ex_msg)
-                return [{'error': ex_msg}]
+                raise RecommendationMiss(ERROR_NO_PLANS, f'ERROR. no plans found for zone {zone}')
 
             rates = self._get_rates_for_zone(zone)
             if not rates:
-                ex_msg = f'ERROR. no rates found for zone {zone}'
-                self._exception_handle(msg=ex_msg)
-                return [{'error': ex_msg}]
+                raise RecommendationMiss(ERROR_NO_RATES, f'ERROR. no rates found for zone {zone}')
+
+            return self._match_note(
+                self._shortlist(zone, plans, rates, duration_days, service_type, data_needed_gb, usage),
+                destination_match
+            )
+
+        except Exception as e:
+            return self._error_result(self._error_from(e), exception=e)
+
+    def _error_from(self, exception: Exception) -> RecommendationError:
+        if isinstance(exception, RecommendationError):
+            return exception
+        ex_msg = f'Recommendation query failed: {exception}'
+        if is_database_error(exception):
+            return RecommendationFault(ERROR_DATABASE, ex_msg, fatal=True)
+        return RecommendationFault(ERROR_INTERNAL, ex_msg)
+
+    def _error_result(self, error: RecommendationError, exception=None) -> list[dict]:
+        """Records the error, misses without touching the recommender status, and returns its result."""
+        with self._lock:
+            if isinstance(error, RecommendationMiss):
+                self.misses += 1
+            else:
+                self.faults += 1
+        self.metric_count('recommend_errors_total', code=error.code)
+        if isinstance(error, RecommendationMiss):
+            self.error = error.message
+        else:
+            cause = None if exception is error else exception
+            self._exception_handle(msg=error.message, exception=cause, is_fatal=error.fatal)
+        return error.result()
+
+    def _materialized_applies(self, duration_days, service_type: str, data_needed_gb, usage) -> bool:
+        """True for the requests covered by the materialized table: default usage, whole days, default scoring."""
+        return (
+            self.materialized
+            and type(duration_days) is int
+            and 1 <= duration_days <= MATERIALIZED_MAX_DURATION_DAYS
+            and service_type in SERVICE_TYPES
+            and data_needed_gb is None
+            and not usage
+            and (self.scoring_strategy or SCORING_STRATEGY_DEFAULT) == SCORING_STRATEGY_DEFAULT
+            and self.recommend_shortlist_num <= MATERIALIZED_SHORTLIST_NUM
+            and self._materialized_load()
+        )
+
+    def _materialized_load(self) -> bool:
+        """Checks once that the materialized table was built from the current plan and rate tables,
+        and in snapshot mode reads it into memory."""
+        if self._materialized_ready is None:
+            ready = not self.catalog_path and materialized_fresh(self.db)
+            if ready and self._snapshot_active():
+                rows = self.db.execute(SQL_MATERIALIZED_ALL) or []
+                self._materialized_shortlists = {
+                    (zone, duration_days, service_type): json.loads(shortlist)
+                    for zone, duration_days, service_type, shortlist in rows
+                }
+            self._materialized_ready = ready
+        return self._materialized_ready
+
+    def _get_materialized_shortlist(self, zone: int, duration_days: int, service_type: str) -> Optional[list[dict]]:
+        if self._snapshot_active():
+            shortlist = self._materialized_shortlists.get((zone, duration_days, service_type))
+        else:
+            rows = self.db.execute(SQL_MATERIALIZED_FETCH, args=(zone, duration_days, service_type))
+            shortlist = json.loads(rows[0][0]) if rows else None
+        if shortlist is None:
+            return None
+        return [dict(r) for r in shortlist[:self.recommend_shortlist_num]]
 
-            # exact match
-            exact_plans = [p for p in plans if p['duration_days'] == duration_days]
-            candidates = exact_plans
+    def _shortlist(self, zone: int, plans: list[dict], rates: dict, duration_days: int,
+                   service_type: str, data_needed_gb: Optional[float], usage: Optional[dict] = None) -> list[dict]:
+        # exact match
+        exact_plans = [p for p in plans if p['duration_days'] == duration_days]
+        candidates = exact_plans
 
-            if not exact_plans:
+        if not exact_plans:
+            with self.span('interpolate'):
                 interpolated = self._interpolate_plan(plans, duration_days, zone)
-                if interpolated:
-                    candidates = [interpolated]
+            if interpolated:
+                candidates = [interpolated]
+
+        if not candidates:
+            candidates = plans
+
+        trip = {
+            'duration_days': duration_days,
+            'service_type': service_type,
+            'data_needed_gb': data_needed_gb,
+            'usage': usage
+        }
+        return self._rank(candidates, rates, trip)
+
+    def _rank(self, candidates: list[dict], rates: dict, trip: dict) -> list[dict]:
+        """Scores all candidates in one call with rates fetched once per request, cheapest first."""
+        self._service_type_check(trip['service_type'])
+        candidate_arrays = {
+            c: np.asarray([p[c] for p in candidates], dtype=np.float64)
+            for c in ['duration_days', 'data_gb', 'price_sgd']
+        }
+        with self.span('score'):
+            costs = score_plans(candidate_arrays, rates, trip, strategy=self.scoring_strategy)
+        order = np.argsort(costs, kind='stable')[:self.recommend_shortlist_num]
+        return [{**{k: v for k, v in candidates[r].items() if k != 'id'}, **rates} for r in order]
+
+    @staticmethod
+    def _service_type_check(service_type: str):
+        if service_type not in SERVICE_TYPES:
+            raise RecommendationMiss(
+                ERROR_SERVICE_TYPE, f'ERROR. unsupported service type: {service_type}. Allowed {SERVICE_TYPES}'
+            )
+
+    @instrumented('optimize_itinerary')
+    def optimize_itinerary(self, legs) -> dict:
+        """
+        Cheapest mix of zone plans and pay-per-use usage for a trip of several legs, see itinerary.py.
+
+        legs: list of dicts with the recommend() keyword arguments,
+            or list of (destination, duration_days, service_type, data_needed_gb) tuples, in travel order
+
+        Returns the itinerary, or {"error", "code"} as in the recommend() error results.
+        """
+        if not self.source_connect():
+            db_error = self.db.error if self.db else self.error
+            return self._error_result(RecommendationFault(
+                ERROR_UNAVAILABLE, f'problem connecting to roaming plan database {db_error}', fatal=True
+            ))[0]
 
-            if not candidates:
-                candidates = plans
+        try:
+            resolved, plans, rates = [], [], {}
+            for n, leg in enumerate(self._trip_records(legs), 1):
+                args = self._trip_args(leg)
+                zone = self._destination_match(args['destination'])['zone']
+                self._service_type_check(args['service_type'])
+                if not whole_days(args['duration_days']):
+                    raise RecommendationMiss(
+                        ERROR_DURATION, f"ERROR. invalid duration for leg {n}: {args['duration_days']!r}"
+                    )
+                if zone not in rates:
+                    rates[zone] = self._get_rates_for_zone(zone)
+                    if not rates[zone]:
+                        raise RecommendationMiss(ERROR_NO_RATES, f'ERROR. no rates found for zone {zone}')
+                    plans.extend(self._get_all_plans_for_zone(zone))
+                resolved.append({**args, 'zone': zone})
+
+            with self.span('solve'):
+                return solve_itinerary(resolved, plans, rates)
 
-            score_results = [
-                (self._score_plan(p, zone, service_type, data_needed_gb), p)
-                for p in candidates
+        except Exception as e:
+            return self._error_result(self._error_from(e), exception=e)[0]
+
+    @instrumented('recommend_many')
+    def recommend_many(self, trips) -> list[list[dict]]:
+        """
+        Batch version of recommend() that scores many trips in one pass over the catalog snapshot.
+
+        trips: list of dicts with the recommend() keyword arguments,
+            list of (destination, duration_days, service_type, data_needed_gb) tuples,
+            or a DataFrame with those columns
+
+        Returns the recommend() result for each trip, in input order.
+        """
+        trip_args = [self._trip_args(t) for t in self._trip_records(trips)]
+        if not trip_args:
+            return []
+
+        if not self._batch_catalog_load():
+            db_error = self.db.error if self.db else self.error
+            error = RecommendationFault(ERROR_UNAVAILABLE, f'problem connecting to roaming plan database {db_error}')
+            return [error.result() for _ in trip_args]
+
+        results = [None] * len(trip_args)
+        destination_matches = [None] * len(trip_args)
+        zone_trips = {}
+        for i, trip in enumerate(trip_args):
+            try:
+                destination_matches[i] = self._destination_match(trip['destination'])
+            except Exception as e:
+                results[i] = self._batch_error(self._error_from(e), exception=e)
+                continue
+            zone_trips.setdefault(destination_matches[i]['zone'], []).append(i)
+
+        for zone, indices in zone_trips.items():
+            zone_results = self._recommend_zone_many(zone, [trip_args[i] for i in indices])
+            for i, result in zip(indices, zone_results):
+                results[i] = self._match_note(result, destination_matches[i])
+
+        return results
+
+    @staticmethod
+    def _trip_records(trips) -> list:
+        if hasattr(trips, 'to_dict'):
+            return trips.to_dict('records')
+        return list(trips)
+
+    @staticmethod
+    def _trip_args(trip) -> dict:
+        if isinstance(trip, dict):
+            args = {
+                'destination': trip['destination'],
+                'duration_days': trip['duration_days'],
+                'service_type': trip.get('service_type', 'data'),
+                'data_needed_gb': trip.get('data_needed_gb'),
+                'usage': trip.get('usage')
+            }
+        else:
+            values = list(trip) + ['data', None, None][len(trip) - 2:]
+            args = dict(zip(['destination', 'duration_days', 'service_type', 'data_needed_gb', 'usage'], values))
+        data_needed_gb = args['data_needed_gb']
+        if isinstance(data_needed_gb, float) and data_needed_gb != data_needed_gb:
+            args['data_needed_gb'] = None
+        return args
+
+    def _batch_error(self, error: RecommendationError, exception=None) -> list[dict]:
+        """Batch errors never close the connection, the other trips of the batch still need it."""
+        if error.fatal:
+            error = RecommendationFault(error.code, error.message)
+        return self._error_result(error, exception=exception)
+
+    def _recommend_zone_many(self, zone: int, trips: list[dict]) -> list[list[dict]]:
+        plans = self.catalog.plan_arrays(zone)
+        if not len(plans['id']):
+            return [
+                self._batch_error(RecommendationMiss(ERROR_NO_PLANS, f'ERROR. no plans found for zone {zone}'))
+                for _ in trips
             ]
-            results = [r for r in score_results if r[0] is not None]
 
-            results_sorted = sorted(results, key=lambda x: -x[0])[:self.recommend_shortlist_num]
-            top_plans = [r[1] for r in results_sorted]
+        rates = self.catalog.rates_for_zone(zone)
+        if not rates:
+            return [
+                self._batch_error(RecommendationMiss(ERROR_NO_RATES, f'ERROR. no rates found for zone {zone}'))
+                for _ in trips
+            ]
 
-            add_rates = [{**{k: v for k, v in p.items() if k != 'id'}, **rates} for p in top_plans]
-            return add_rates
+        numeric = [isinstance(t['duration_days'], (int, float, np.number)) for t in trips]
+        durations = np.asarray(
+            [t['duration_days'] if n else np.nan for t, n in zip(trips, numeric)], dtype=np.float64
+        )
+
+        # exact match or interpolation between the neighbouring plan durations, for all trips at once
+        curve = self.catalog.curve_for_zone(zone)
+        exact = curve.contains(durations)
+        interpolated = curve.interpolate(durations)
+        interpolable = ~exact & interpolated['valid']
+
+        plan_records = self.catalog.plans_for_zone(zone)
+        results = [None] * len(trips)
+        trip_keys = {}
+        for i, trip in enumerate(trips):
+            if not numeric[i]:
+                try:
+                    results[i] = self._shortlist(zone, plan_records, rates, **{
+                        k: trip[k] for k in ['duration_days', 'service_type', 'data_needed_gb', 'usage']
+                    })
+                except Exception as e:
+                    results[i] = self._batch_error(self._error_from(e), exception=e)
+                continue
+
+            duration_days = trip['duration_days']
+            usage = trip['usage']
+            key = (
+                duration_days, type(duration_days), trip['service_type'], trip['data_needed_gb'],
+                tuple(sorted(usage.items())) if usage else None
+            )
+            trip_keys.setdefault(key, []).append(i)
 
+        try:
+            get_scoring_strategy(self.scoring_strategy or SCORING_STRATEGY_DEFAULT)
+            strategy_error = None
+        except Exception as e:
+            strategy_error = e
+
+        # distinct trips are ranked against the zone's plans, except interpolated ones with a single candidate
+        shortlists, ranked = {}, []
+        for key, indices in trip_keys.items():
+            i = indices[0]
+            try:
+                self._service_type_check(trips[i]['service_type'])
+                if strategy_error is not None:
+                    raise strategy_error
+            except Exception as e:
+                shortlists[key] = self._batch_error(self._error_from(e), exception=e)
+                continue
+            if interpolable[i]:
+                shortlists[key] = [{
+                    'zone': zone,
+                    'duration_days': trips[i]['duration_days'],
+                    'data_gb': float(interpolated['data_gb'][i]),
+                    'price_sgd': float(interpolated['price_sgd'][i]),
+                    **rates
+                }]
+            else:
+                ranked.append(key)
+
+        if ranked:
+            firsts = [trip_keys[k][0] for k in ranked]
+            shortlists.update(self._rank_many(
+                plans, plan_records, rates, ranked, [trips[i] for i in firsts], exact[firsts], durations[firsts]
+            ))
+
+        for key, indices in trip_keys.items():
+            for i in indices:
+                results[i] = [dict(r) for r in shortlists[key]]
+        return results
+
+    def _rank_many(self, plans: dict[str, np.ndarray], plan_records: list[dict], rates: dict, keys: list,
+                   trips: list[dict], exact: np.ndarray, durations: np.ndarray) -> dict:
+        """_rank() for many trips of a zone, scores the trips x plans matrix in one call and ranks it in one
+        argsort. The candidates of a trip are the plans of its duration if there are any, else all plans."""
+        candidates = np.where(
+            exact[:, None], plans['duration_days'][None, :] == durations[:, None], True
+        )
+        candidate_arrays = {
+            c: np.asarray(plans[c], dtype=np.float64) for c in ['duration_days', 'data_gb', 'price_sgd']
+        }
+        try:
+            with self.span('score'):
+                costs = score_plans_many(candidate_arrays, rates, trips, strategy=self.scoring_strategy)
         except Exception as e:
-            ex_msg = f'Recommendation query failed: {e}'
-            self._exception_handle(msg=ex_msg, exception=e)
-            return [{'error': ex_msg}]
+            return {key: self._batch_error(self._error_from(e), exception=e) for key in keys}
+
+        order = np.argsort(np.where(candidates, costs, np.inf), axis=1, kind='stable')
+        shortlists = {}
+        for key, rows, row_candidates in zip(keys, order, candidates):
+            shortlists[key] = [
+                {**{k: v for k, v in plan_records[r].items() if k != 'id'}, **rates}
+                for r in rows[row_candidates[rows]][:self.recommend_shortlist_num]
+            ]
+        return shortlists
+
+    def _snapshot_active(self) -> bool:
+        return self.snapshot and self.catalog is not None
+
+    def _compiled_active(self) -> bool:
+        return self._snapshot_active() and self.catalog.compiled is not None
+
+    def _destination_match(self, destination: str) -> dict:
+        """The resolved destination {"country", "zone", "match"}. Raises RecommendationMiss, with the countries
+        to confirm if the name only resembles some."""
+        destination_index = self.destination_index_load()
+        if destination_index is None:
+            zone = self._get_zone_from_destination(destination)
+            if zone is None:
+                raise RecommendationMiss(ERROR_NO_ZONE, f'ERROR. no zone found for {destination}')
+            return {'country': destination, 'zone': zone, 'match': 'exact'}
+
+        match = destination_index.resolve(destination)
+        if match is not None:
+            return match
+        candidates = destination_index.suggestions(destination)
+        if candidates:
+            raise RecommendationMiss(
+                ERROR_AMBIGUOUS_DESTINATION,
+                f"ERROR. no certain match for {destination}, did you mean {' or '.join(candidates)}?",
+                candidates=candidates
+            )
+        raise RecommendationMiss(ERROR_NO_ZONE, f'ERROR. no zone found for {destination}')
+
+    @staticmethod
+    def _match_note(shortlist: list[dict], destination_match: dict) -> list[dict]:
+        """Marks the rows of a shortlist for a fuzzy matched destination with the country it was resolved to."""
+        if destination_match['match'] != 'fuzzy' or not shortlist or 'error' in shortlist[0]:
+            return shortlist
+        return [{**row, 'country': destination_match['country'], 'match': 'fuzzy'} for row in shortlist]
 
     def _get_zone_from_destination(self, country: str) -> Optional[int]:
-        self.db.execute("SELECT zone FROM destination WHERE lower(country) = ?", args=(country.lower(),))
-        result = self.db.cursor.fetchone()
-        return result[0] if result else None
-
-    def _get_rates_for_zone(self, zone: int) -> list[dict]:
-        self.db.execute("SELECT rate_data_per_10kb, rate_calls_outgoing_per_min, rate_calls_incoming_per_min, rate_per_sms FROM ppu_rate WHERE zone = ?", args=(zone,))
-        columns = [desc[0] for desc in self.db.cursor.description]
-        result = self.db.cursor.fetchone()
-        rates = dict(zip(columns, result)) if result else {}
+        destination_index = self.destination_index_load()
+        if destination_index is not None:
+            return destination_index.zone(country)
+        if self._snapshot_active():
+            return self.catalog.zone_for_destination(country)
+        rows = self.db.execute(SQL_ZONE_FOR_DESTINATION, args=(country.lower(),), re_raise=True)
+        return rows[0][0] if rows else None
+
+    def _get_rates_for_zone(self, zone: int) -> dict:
+        if self._snapshot_active():
+            return self.catalog.rates_for_zone(zone)
+        rows = self.db.execute(SQL_RATES_FOR_ZONE, args=(zone,), re_raise=True)
+        rates = dict(rows[0]) if rows else {}
         return rates
 
     def _get_all_plans_for_zone(self, zone: int) -> list[dict]:
-        self.db.execute("SELECT * FROM plan WHERE zone = ?", args=(zone,))
-        columns = [desc[0] for desc in self.db.cursor.description]
-        plans = [dict(zip(columns, row)) for row in self.db.cursor.fetchall()]
+        if self._snapshot_active():
+            return self.catalog.plans_for_zone(zone)
+        rows = self.db.execute(SQL_PLANS_FOR_ZONE, args=(zone,), re_raise=True)
+        plans = [dict(row) for row in rows or []]
         return plans
 
-    def _interpolate_plan(self, plans: list[dict], duration: int, zone: int) -> Optional[dict]:
-        lower = [p for p in plans if p['duration_days'] < duration]
-        upper = [p for p in plans if p['duration_days'] > duration]
-
-        if not lower or not upper:
-            return None
-
-        p_low = max(lower, key=lambda x: x['duration_days'])
-        p_high = min(upper, key=lambda x: x['duration_days'])
-
-        def interp(field):
-            x0, y0 = p_low['duration_days'], p_low[field]
-            x1, y1 = p_high['duration_days'], p_high[field]
-            return round(y0 + ((duration - x0) / (x1 - x0)) * (y1 - y0), 2)
-
-        return {
-            'zone': zone,
-            'duration_days': duration,
-            'data_gb': interp('data_gb'),
-            'price_sgd': interp('price_sgd'),
-            'id': -1  # synthetic
-        }
+    def _plan_curve(self, zone: int, plans: list[dict]) -> PlanCurve:
+        if self._snapshot_active():
+            return self.catalog.curve_for_zone(zone)
+        return PlanCurve.from_plans(plans)
 
-    def _score_plan(self, plan: dict, zone: int, service: str, data_needed: float) -> Optional[float]:
-        if service == "data":
-            return plan['data_gb']
-        
-        elif service == "calls":
-            self.db.execute("SELECT rate_calls_outgoing_per_min FROM ppu_rate WHERE zone = ?", (zone,))
-            return -self.db.cursor.fetchone()[0]
-        
-        elif service == "sms":
-            self.db.execute("SELECT rate_per_sms FROM ppu_rate WHERE zone = ?", (zone,))
-            return -float(self.db.cursor.fetchone()[0])
-        
-        elif service not in SERVICE_TYPES:
-            msg = f'unsupported service type: {service}. Allowed {SERVICE_TYPES}'
-            raise ValueError(msg)
-        
-        return None
+    def _interpolate_plan(self, plans: list[dict], duration: int, zone: int) -> Optional[dict]:
+        return self._plan_curve(zone, plans).interpolate_plan(duration, zone)
 
     def get_destinations(self) -> dict:
         """Returns a lookup dict mapping lowercase country names to canonical country names."""
-        if not self.db_connect():
+        if not self.source_connect():
             return {}
+        destination_index = self.destination_index_load()
+        if destination_index is not None:
+            return destination_index.destinations()
+        if self._snapshot_active():
+            return self.catalog.destination_names()
         try:
-            self.db.execute("SELECT country FROM destination")
-            rows = self.db.cursor.fetchall()
+            rows = self.db.execute(SQL_DESTINATIONS, re_raise=True)
             return {country.lower(): country for (country,) in rows}
         except Exception as e:
             self._exception_handle(msg="failed to fetch destinations", exception=e, is_fatal=False)
-            return {}
\ No newline at end of file
+            return {}
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def verify_query_plans(db: Optional[DBConnector] = None) -> dict[str, list[str]]:
+    """
+    Runs EXPLAIN QUERY PLAN on each of the LOOKUP_QUERIES whose table exists.
+    Returns the full scan steps of the queries that scan.
+    """
+    db = db or DBConnector(read_only=True)
+    if not db.connect():
+        raise RuntimeError(f'problem connecting to roaming plan database {db.error}')
+    tables = {r['name'] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    scans = {}
+    for name, (table_name, stm, args) in LOOKUP_QUERIES.items():
+        if table_name not in tables:
+            continue
+        full_scans = db.full_scans(stm, args=args)
+        if full_scans:
+            scans[name] = full_scans
+    return scans
+
+
+def materialized_config_hash() -> str:
+    config = [
+        MATERIALIZED_MAX_DURATION_DAYS, MATERIALIZED_SHORTLIST_NUM, SERVICE_TYPES, SCORING_STRATEGY_DEFAULT,
+        SCORING_MODEL_VERSION
+    ]
+    return hashlib.sha256(json.dumps(config).encode('utf-8')).hexdigest()
+
+
+def materialized_source_hash(db: DBConnector) -> Optional[str]:
+    """Hash of the last build hashes of the plan and rate tables, None if they have not been built."""
+    rows = db.execute(
+        f"SELECT table_name, schema_hash, data_hash FROM {BUILD_META_TABLE} "
+        f"WHERE table_name IN ({', '.join('?' for _ in MATERIALIZED_SOURCE_TABLES)}) ORDER BY table_name",
+        args=tuple(MATERIALIZED_SOURCE_TABLES)
+    )
+    if not rows or len(rows) != len(MATERIALIZED_SOURCE_TABLES):
+        return None
+    return hashlib.sha256(json.dumps([list(r) for r in rows]).encode('utf-8')).hexdigest()
+
+
+def materialized_fresh(db: DBConnector) -> bool:
+    """True if the materialized table exists and was built from the current plan and rate tables."""
+    source_hash = materialized_source_hash(db)
+    rows = db.execute(
+        f"SELECT schema_hash, data_hash FROM {BUILD_META_TABLE} WHERE table_name = ?", args=(MATERIALIZED_TABLE,)
+    )
+    return bool(source_hash and rows and tuple(rows[0]) == (materialized_config_hash(), source_hash))
+
+
+def materialize_recommendations(db: DBConnector, force=False) -> bool:
+    """
+    Precomputes the ranked shortlist of every (zone, duration_days, service_type) request with default usage
+    into the recommendation table. Skipped if the table is fresh unless force is set. Returns True on success.
+    """
+    if not force and materialized_fresh(db):
+        return True
+    recommender = RoamingPlanRecommender(shortlist_num=MATERIALIZED_SHORTLIST_NUM, snapshot=True)
+    recommender.db = db
+    if not recommender.catalog_load(refresh=True):
+        return False
+    catalog = recommender.catalog
+    rows = []
+    for zone in catalog.zone_slices:
+        plans = catalog.plans_for_zone(zone)
+        rates = catalog.rates_for_zone(zone)
+        if not rates:
+            continue
+        for duration_days in range(1, MATERIALIZED_MAX_DURATION_DAYS + 1):
+            for service_type in SERVICE_TYPES:
+                shortlist = recommender._shortlist(zone, plans, rates, duration_days, service_type, None)
+                rows.append((zone, duration_days, service_type, json.dumps(shortlist)))
+
+    built_at = datetime.now(timezone.utc).isoformat()
+    try:
+        with db.checkout() as conn:
+            with conn:
+                conn.execute(f'DROP TABLE IF EXISTS {MATERIALIZED_TABLE}')
+                conn.execute(SQL_MATERIALIZED_CREATE)
+                conn.executemany(f'INSERT INTO {MATERIALIZED_TABLE} VALUES (?, ?, ?, ?)', rows)
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {BUILD_META_TABLE} (table_name, schema_hash, data_hash, built_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (MATERIALIZED_TABLE, materialized_config_hash(), materialized_source_hash(db), built_at)
+                )
+    except Exception as e:
+        db._exception_handle(msg='failed to materialize recommendations', exception=e, is_fatal=False)
+        return False
+    return True
+
+
+def verify_materialized(db: Optional[DBConnector] = None) -> list[dict]:
+    """Compares every materialized shortlist with the live computation. Returns the requests that differ."""
+    db = db or DBConnector(read_only=True)
+    if not db.connect():
+        raise RuntimeError(f'problem connecting to roaming plan database {db.error}')
+    if not materialized_fresh(db):
+        return [{'error': 'materialized recommendations are missing or stale'}]
+    live = RoamingPlanRecommender(shortlist_num=MATERIALIZED_SHORTLIST_NUM)
+    live.db = db
+    mismatches = []
+    for zone, duration_days, service_type, shortlist in db.execute(SQL_MATERIALIZED_ALL):
+        plans = live._get_all_plans_for_zone(zone)
+        rates = live._get_rates_for_zone(zone)
+        expected = live._shortlist(zone, plans, rates, duration_days, service_type, None)
+        if json.loads(shortlist) != expected:
+            mismatches.append({'zone': zone, 'duration_days': duration_days, 'service_type': service_type})
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='roaming plan recommender maintenance commands')
+    parser.add_argument('--verify-query-plans', action='store_true',
+                        help='fail if any per-request query does a full table scan')
+    parser.add_argument('--verify-materialized', action='store_true',
+                        help='fail if any materialized shortlist differs from the live computation')
+    cli_args = parser.parse_args()
+    if cli_args.verify_query_plans:
+        query_scans = verify_query_plans()
+        for query_name, details in query_scans.items():
+            print(f'{query_name}: {"; ".join(details)}')
+        if query_scans:
+            sys.exit(1)
+        print(f'{len(LOOKUP_QUERIES)} queries use index searches')
+    if cli_args.verify_materialized:
+        materialized_mismatches = verify_materialized()
+        for mismatch in materialized_mismatches:
+            print(mismatch)
+        if materialized_mismatches:
+            sys.exit(1)
+        print('materialized recommendations match the live computation')
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""record/replay chat model backend for offline, deterministic classifier runs
+
+ReplayLLM
+
+  - stands in for the chat model injected into BaseLLMIntentClassifier(llm=...), with the
+    invoke, ainvoke, batch, stream and astream calls the classifier uses
+  - responses are keyed by a hash of the prompt messages, so that any change to the prompt is a miss
+  - modes
+    - record: every call goes to the live model and the response is saved to the cassette file
+    - replay: calls are served from the cassette, a prompt that was never recorded raises CassetteMiss
+    - auto: replays recorded prompts and records the others
+  - scripted responses, a dict of user input -> response text or a function of the messages,
+    are answered before the cassette is checked
+  - replayed and scripted responses wait latency_seconds plus up to jitter_seconds, drawn from a seeded
+    random generator, to simulate the model in load tests
+
+cassette file, JSON
+    {
+        "version": 1,
+        "interactions": {
+            <prompt hash>: {"user": <last message>, "content": <response text>, "usage": <token usage or null>}
+        }
+    }
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+from base import BaseHandler
+from .cache import normalize_input
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+CASSETTE_VERSION = 1
+REPLAY_MODES = ['record', 'replay', 'auto']
+REPLAY_MODE_DEFAULT = 'replay'
+CHUNK_SIZE_DEFAULT = 8
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def prompt_hash(messages: list) -> str:
+    key_json = json.dumps([[getattr(m, 'type', m.__class__.__name__), m.content] for m in messages])
+    return hashlib.sha256(key_json.encode('utf-8')).hexdigest()
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class CassetteMiss(LookupError):
+    pass
+
+
+class ReplayResponse:
+    """Message with the content and usage_metadata attributes of a chat model response or stream chunk."""
+
+    def __init__(self, content: str, usage_metadata: Optional[dict] = None):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(content={self.content!r})'
+
+
+class ReplayLLM(BaseHandler):
+    def __init__(self, cassette_path='', mode=None, llm=None, llm_model='', scripted=None,
+                 latency_seconds=0.0, jitter_seconds=0.0, seed=None, chunk_size=None):
+        self.cassette_path: str = cassette_path
+        self.mode: str = mode or REPLAY_MODE_DEFAULT
+        if self.mode not in REPLAY_MODES:
+            raise ValueError(f"unknown replay mode '{self.mode}', expected one of {', '.join(REPLAY_MODES)}")
+        self.llm_model: str = llm_model
+        self.scripted = scripted
+        self.latency_seconds: float = latency_seconds
+        self.jitter_seconds: float = jitter_seconds
+        self.chunk_size: int = chunk_size or CHUNK_SIZE_DEFAULT
+        self.interactions: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.scripted_hits = 0
+        self._llm = llm
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        super().__init__()
+        self.cassette_load()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.mode}, {len(self.interactions)} interactions [{self.status()}]>'
+
+    def exit(self):
+        pass
+
+    @property
+    def llm(self):
+        """The live chat model for recording, an OpenAI client is created on first use unless one was injected."""
+        if self._llm is None:
+            from dotenv import load_dotenv
+            from langchain_openai import ChatOpenAI
+            from .chat_agent import LLM_MODEL_DEFAULT
+            load_dotenv()
+            self._llm = ChatOpenAI(model=self.llm_model or LLM_MODEL_DEFAULT, temperature=0)
+        return self._llm
+
+    def cassette_load(self) -> bool:
+        if not self.cassette_path or not os.path.exists(self.cassette_path):
+            return False
+        try:
+            with open(self.cassette_path, encoding='utf-8') as f:
+                cassette = json.load(f)
+            self.interactions = dict(cassette.get('interactions', {}))
+            self._status_code = 1
+            return True
+        except Exception as e:
+            self._exception_handle(msg=f'failed to load cassette {self.cassette_path}', exception=e, is_fatal=False)
+            return False
+
+    def cassette_save(self):
+        """Writes the cassette to a temporary file and moves it into place, so that readers never see half a file."""
+        if not self.cassette_path:
+            return
+        directory = os.path.dirname(self.cassette_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.cassette_path}.tmp'
+        with self._lock:
+            cassette = {'version': CASSETTE_VERSION, 'interactions': dict(sorted(self.interactions.items()))}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cassette, f, indent=2, ensure_ascii=False)
+                f.write('\n')
+            os.replace(tmp_path, self.cassette_path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'recorded': self.recorded,
+                'scripted': self.scripted_hits,
+                'interactions': len(self.interactions)
+            }
+
+    def invoke(self, messages, **kwargs) -> ReplayResponse:
+        response, replayed = self._respond(messages, **kwargs)
+        if replayed:
+            time.sleep(self._delay())
+        return response
+
+    async def ainvoke(self, messages, **kwargs) -> ReplayResponse:
+        if self._needs_live(messages):
+            # the live model is called through the blocking path so that recording stays in one place
+            return await asyncio.to_thread(self.invoke, messages, **kwargs)
+        response, _ = self._respond(messages, **kwargs)
+        await asyncio.sleep(self._delay())
+        return response
+
+    def batch(self, messages_list, config=None, return_exceptions=False, **kwargs) -> list:
+        """Responses in input order, the synthetic latency is applied once as if the batch ran concurrently."""
+        responses, delays = [], []
+        for messages in messages_list:
+            try:
+                response, replayed = self._respond(messages, **kwargs)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                responses.append(e)
+                continue
+            if replayed:
+                delays.append(self._delay())
+            responses.append(response)
+        if delays:
+            time.sleep(max(delays))
+        return responses
+
+    def stream(self, messages, **kwargs):
+        response = self.invoke(messages, **kwargs)
+        for i in range(0, len(response.content), self.chunk_size):
+            yield ReplayResponse(response.content[i:i + self.chunk_size])
+
+    async def astream(self, messages, **kwargs):
+        response = await self.ainvoke(messages, **kwargs)
+        for i in range(0, len(response.content), self.chunk_size):
+            yield ReplayResponse(response.content[i:i + self.chunk_size])
+
+    def _scripted_content(self, messages) -> Optional[str]:
+        if self.scripted is None:
+            return None
+        if callable(self.scripted):
+            return self.scripted(messages)
+        user_input = normalize_input(messages[-1].content)
+        for scripted_input, content in self.scripted.items():
+            if normalize_input(scripted_input) == user_input:
+                return content
+        return None
+
+    def _needs_live(self, messages) -> bool:
+        if self.mode == 'replay' or self._scripted_content(messages) is not None:
+            return False
+        return self.mode == 'record' or prompt_hash(messages) not in self.interactions
+
+    def _respond(self, messages, **kwargs) -> tuple[ReplayResponse, bool]:
+        """The response and whether it was served locally, so that the synthetic latency applies."""
+        content = self._scripted_content(messages)
+        if content is not None:
+            with self._lock:
+                self.scripted_hits += 1
+            return ReplayResponse(content), True
+
+        key = prompt_hash(messages)
+        if self.mode != 'record':
+            with self._lock:
+                interaction = self.interactions.get(key)
+                if interaction is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if interaction is not None:
+                return ReplayResponse(interaction['content'], interaction.get('usage')), True
+            if self.mode == 'replay':
+                raise CassetteMiss(f'no recorded response for prompt {key[:12]}: {messages[-1].content!r}')
+
+        response = self.llm.invoke(messages, **kwargs)
+        usage = getattr(response, 'usage_metadata', None)
+        with self._lock:
+            self.interactions[key] = {
+                'user': messages[-1].content,
+                'content': response.content,
+                'usage': dict(usage) if usage else None
+            }
+            self.recorded += 1
+        self.cassette_save()
+        return ReplayResponse(response.content, usage), False
+
+    def _delay(self) -> float:
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0.0
+        return self.latency_seconds + jitter
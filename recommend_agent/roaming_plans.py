@@ -1,17 +1,51 @@
 #!/usr/bin/env python3
 """backend module for the roaming plans SQLite database
+
+DBConnector
+
+  - each thread gets its own sqlite3 connection on connect(), so a connector can be shared by a thread pool,
+    the connection is closed when its thread exits
+  - checkout() hands out pooled connections for callers that manage their own unit of work
+  - execute() returns the result rows, there is no shared cursor state
+  - read_only=True opens the database as a file: URI with mode=ro
+  - build() switches the database file to WAL journaling, which persists in the file, so that readers
+    do not block on the writer
+  - build() only reloads the tables whose schema definition or CSV content changed since the last build,
+    tracked by content hashes in the build_meta table, build(force=True) rebuilds every table
+  - tables are created with the indexes declared in the schema file, each table entry may list
+    "indexes": [{"index_name": <name>, "columns": [<column or expression>, ...], "unique": 0 | 1}]
+  - full_scans() reports the EXPLAIN QUERY PLAN steps of a statement that scan instead of search
+  - connections_opened counts every sqlite3 connection opened, also as the db_connections_opened_total metric,
+    so that connection churn shows up in steady state
 """
 
 # constants ----------------------------------------------------------------------------------
+import argparse
+import csv
+import hashlib
 import json
-import pandas as pd
+import queue
 import sqlite3
-from base import BaseHandler
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+from base import BaseHandler, instrumented
 
 
 # constants ----------------------------------------------------------------------------------
 DB_PATH = 'plans.sqlite'
 DB_SCHEMA_PATH = 'data/schema.json'
+POOL_SIZE_DEFAULT = 8
+STATEMENT_CACHE_SIZE = 256
+BUILD_META_TABLE = 'build_meta'
+SQL_BUILD_META_CREATE = f"""CREATE TABLE IF NOT EXISTS {BUILD_META_TABLE} (
+    table_name TEXT PRIMARY KEY,
+    schema_hash TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    built_at TEXT NOT NULL
+);"""
 
 
 # helper functions -------------------------------------------------------------------------------------
@@ -32,14 +66,60 @@ def create_table_sql(table_name: str, columns: list[dict]) -> str:
     return create_stm
 
 
+def create_index_sql(table_name: str, index: dict) -> str:
+    """CREATE INDEX statement for a schema index declaration, columns may be expressions such as lower(country)."""
+    unique = "UNIQUE " if index.get('unique', 0) == 1 else ""
+    col_clause = ", ".join(index['columns'])
+    return f"CREATE {unique}INDEX IF NOT EXISTS {index['index_name']} ON {table_name} ({col_clause});"
+
+
+def schema_hash(table_config: dict) -> str:
+    schema_json = json.dumps(table_config, sort_keys=True)
+    return hashlib.sha256(schema_json.encode('utf-8')).hexdigest()
+
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _thread_connection_release(connector_ref: weakref.ref, conn: sqlite3.Connection):
+    connector = connector_ref()
+    if connector is not None:
+        connector._connection_close(conn)
+    else:
+        conn.close()
+
+
 # classes ---------------------------------------------------------------------------------------------------------
+class _ThreadConnection:
+    """Holds a thread's connection in thread-local storage, which is cleared when the thread exits,
+    the finalizer then closes the connection and drops it from the connector."""
+
+    def __init__(self, connector, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+        weakref.finalize(self, _thread_connection_release, weakref.ref(connector), conn)
+
+
 class DBConnector(BaseHandler):
-    def __init__(self, db_path='', schema_file='', schema=[]):
+    def __init__(self, db_path='', schema_file='', schema=[], read_only=False, pool_size=None):
         self.db_path: str = db_path or DB_PATH
         self.schema_file: str = schema_file or DB_SCHEMA_PATH
         self.schema: list[dict] = schema
-        self.conn = None
-        self.cursor = None
+        self.read_only: bool = read_only
+        self.pool_size: int = pool_size or POOL_SIZE_DEFAULT
+        self._local = threading.local()
+        # reentrant, a thread connection finalizer may run while its thread holds the lock
+        self._lock = threading.RLock()
+        self._connections: list[sqlite3.Connection] = []
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._generation = 0
+        self.connections_opened = 0
+        self.build_tables: list[str] = []
         super().__init__()
         self._set_schema()
 
@@ -55,8 +135,20 @@ class DBConnector(BaseHandler):
     def __repr__(self):
         return f'<{self.__class__.__name__} [{self.status()}]>'
 
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        """The connection of the calling thread, None if this thread has not connected yet."""
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None and holder.generation == self._generation:
+            return holder.conn
+        return None
+
+    @conn.setter
+    def conn(self, conn):
+        self._local.holder = _ThreadConnection(self, conn, self._generation)
+
     def connected(self):
-        return self._status_code == 1
+        return self._status_code == 1 and self.conn is not None
 
     def commit(self, is_fatal=True, re_raise=False):
         try:
@@ -66,28 +158,62 @@ class DBConnector(BaseHandler):
             self._exception_handle(exception=e, is_fatal=is_fatal, re_raise=re_raise)
             return False
 
-    def execute(self, stm, args=None, is_fatal=False, re_raise=False):
+    @instrumented('execute')
+    def execute(self, stm, args=None, conn=None, is_fatal=False, re_raise=False) -> Optional[list[sqlite3.Row]]:
+        """Runs a statement on the calling thread's connection, or on conn if given.
+        Returns the result rows, an empty list for statements without results, or None on failure.
+        """
         try:
+            conn = conn or self.conn
             if args:
-                self.cursor.execute(stm, args)
+                cursor = conn.execute(stm, args)
             else:
-                self.cursor.execute(stm)
-            return True
+                cursor = conn.execute(stm)
+            return cursor.fetchall()
         except Exception as e:
             self._exception_handle(exception=e, is_fatal=is_fatal, re_raise=re_raise)
-            return False
+            return None
 
-    def build(self, keep_open=True):
+    @contextmanager
+    def checkout(self):
+        """Checks out a pooled connection for the duration of a with block."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connection_open()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                reusable = conn in self._connections
+            if reusable:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    self._connection_close(conn)
+
+    def build(self, keep_open=True, force=False):
+        """Rebuilds the tables whose inputs changed since the last build, or every table when force is set."""
+        if self.read_only:
+            self._exception_handle(msg=f'cannot build read-only database {self.db_path}', is_fatal=False)
+            return False
         connect_success = self.connect()
         if connect_success:
             try:
-                self.tables_drop()
-                self.tables_create()
-                self.data_insert()
-                self.commit()
+                self.execute('PRAGMA journal_mode=WAL;', re_raise=True)
+                self.build_tables = self.tables_changed(force=force)
+                if self.build_tables:
+                    self.execute('BEGIN', re_raise=True)
+                    self.tables_drop(self.build_tables)
+                    self.tables_create(self.build_tables)
+                    self.data_insert(self.build_tables)
+                    self.build_meta_update(self.build_tables)
+                    self.commit()
                 if not keep_open:
                     self.close()
             except Exception as e:
+                if self.conn and self.conn.in_transaction:
+                    self.conn.rollback()
                 msg = 'build failed'
                 self._exception_handle(msg=msg, exception=e)
                 return False
@@ -99,40 +225,113 @@ class DBConnector(BaseHandler):
         else:
             return False
 
-    def data_insert(self):
-        for table in self.tables:
-            table_name = table['table_name']
-            filepath = table['filepath']
-            try:
-                df = pd.read_csv(filepath)
-                df.to_sql(table_name, self.conn, if_exists="append", index=False)
-            except Exception as e:
-                msg = f'failed to insert data for table {table_name}'
-                self._exception_handle(msg=msg, exception=e, re_raise=True)
+    def tables_changed(self, force=False) -> list[str]:
+        """Names of the tables that are missing or whose schema or CSV hash differs from the last build."""
+        self.execute(SQL_BUILD_META_CREATE, re_raise=True)
+        if force:
+            return list(self.table_names)
+        rows = self.execute(f'SELECT table_name, schema_hash, data_hash FROM {BUILD_META_TABLE}', re_raise=True)
+        built = {r['table_name']: (r['schema_hash'], r['data_hash']) for r in rows}
+        existing = {r['name'] for r in self.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'", re_raise=True
+        )}
+        return [
+            t for t in self.table_names
+            if t not in existing or built.get(t) != self.table_hashes(t)
+        ]
+
+    def table_hashes(self, table_name) -> tuple[str, str]:
+        table_config = self._table_config(table_name)
+        return schema_hash(table_config), file_hash(table_config['filepath'])
+
+    def build_meta_update(self, table_names):
+        built_at = datetime.now(timezone.utc).isoformat()
+        rows = [(t, *self.table_hashes(t), built_at) for t in table_names]
+        self.conn.executemany(
+            f'INSERT OR REPLACE INTO {BUILD_META_TABLE} (table_name, schema_hash, data_hash, built_at) '
+            'VALUES (?, ?, ?, ?)', rows
+        )
+
+    def data_insert(self, table_names=None):
+        for table_name in table_names or self.table_names:
+            self.table_insert(table_name)
+
+    def table_insert(self, table_name):
+        filepath = self._table_config(table_name)['filepath']
+        try:
+            with open(filepath, newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                insert_stm = (
+                    f'INSERT INTO {table_name} ({", ".join(header)}) '
+                    f'VALUES ({", ".join("?" for _ in header)})'
+                )
+                self.conn.executemany(insert_stm, (
+                    [value if value != '' else None for value in row] for row in reader if row
+                ))
+        except Exception as e:
+            msg = f'failed to insert data for table {table_name}'
+            self._exception_handle(msg=msg, exception=e, re_raise=True)
 
-    def tables_drop(self):
-        for t in self.table_names:
+    def tables_drop(self, table_names=None):
+        for t in table_names or self.table_names:
             self.table_drop(t)
 
     def table_drop(self, table_name):
         SQL_DROP = f'DROP TABLE IF EXISTS {table_name};'
         self.execute(SQL_DROP, re_raise=True)
 
-    def tables_create(self):
-        for t in self.table_names:
+    def tables_create(self, table_names=None):
+        for t in table_names or self.table_names:
             self.table_create(t)
 
+    def _table_config(self, table_name) -> dict:
+        return [t for t in self.tables if t['table_name']==table_name][0]
+
     def table_create(self, table_name):
-        table_config = [t for t in self.tables if t['table_name']==table_name][0]
+        table_config = self._table_config(table_name)
         columns = table_config.get('columns', [])
         create_tbl_stm = create_table_sql(table_name, columns)
         self.execute(create_tbl_stm, re_raise=True)
+        for index in table_config.get('indexes', []):
+            self.execute(create_index_sql(table_name, index), re_raise=True)
+
+    def query_plan(self, stm, args=None) -> list[str]:
+        """The EXPLAIN QUERY PLAN detail lines of a statement."""
+        rows = self.execute(f'EXPLAIN QUERY PLAN {stm}', args=args, re_raise=True)
+        return [row['detail'] for row in rows]
+
+    def full_scans(self, stm, args=None) -> list[str]:
+        """The query plan steps of a statement that scan a whole table or index instead of searching it."""
+        return [detail for detail in self.query_plan(stm, args=args) if detail.startswith('SCAN')]
+
+    def _connection_open(self) -> sqlite3.Connection:
+        if self.read_only:
+            conn = sqlite3.connect(
+                f'file:{self.db_path}?mode=ro', uri=True,
+                check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+            )
+        else:
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+            )
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._connections.append(conn)
+            self.connections_opened += 1
+        self.metric_count('db_connections_opened_total')
+        return conn
+
+    def _connection_close(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
 
     def connect(self):
         if not self.connected():
             try:
-                self.conn = sqlite3.connect(DB_PATH)
-                self.cursor = self.conn.cursor()
+                self.conn = self._connection_open()
                 self._status_code = 1
                 return True
             except Exception as e:
@@ -144,27 +343,48 @@ class DBConnector(BaseHandler):
 
     def exit(self):
         self.close()
-        if self.conn:
-            self.conn = None
-            self.cursor = None
 
     def close(self):
-        if self.conn:
+        """Closes the connections of all threads and the pool."""
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+            self._generation += 1
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        success = True
+        for conn in connections:
             try:
-                self.conn.close()
-                return True
+                conn.close()
             except Exception as e:
                 msg = 'problem closing db connection'
                 self._exception_handle(msg=msg, exception=e, is_fatal=False)
-                return False
+                success = False
+        return success
 
 # entry point ----------------------------------------------------------------------------------------
-def db_build(keep_open=True):
+def db_build(keep_open=True, force=False, materialize=False, compile_catalog=False):
+    """Builds the database, with materialize the precomputed recommendation table, see recommend.py,
+    and with compile_catalog the binary catalog file unless it is up to date, see compiled.py."""
     db = DBConnector()
-    success = db.build(keep_open=keep_open)
+    success = db.build(keep_open=True, force=force)
+    if success and materialize:
+        from .recommend import materialize_recommendations
+        success = materialize_recommendations(db, force=force)
+    if success and compile_catalog:
+        from .compiled import catalog_compile, catalog_fresh
+        if force or not catalog_fresh(db):
+            success = catalog_compile(db)
+    if not keep_open:
+        db.close()
     errors = db.error
     return success, errors
 
 
 if __name__ == '__main__':
-    db_build(keep_open=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='build the roaming plans database from the CSV files')
+    parser.add_argument('--force', action='store_true', help='rebuild every table even if its inputs are unchanged')
+    parser.add_argument('--materialize', action='store_true', help='precompute the recommendation table')
+    parser.add_argument('--compile', action='store_true', help='write the compiled binary catalog file')
+    cli_args = parser.parse_args()
+    db_build(keep_open=False, force=cli_args.force, materialize=cli_args.materialize,
+             compile_catalog=cli_args.compile)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""plan scoring strategies for the roaming plan recommender
+
+score_plans()
+
+  - takes inputs
+    - plans: candidate plan columns as arrays {"data_gb": [...], "price_sgd": [...], "duration_days": [...]}
+    - rates: pay-per-use rates of the zone, fetched once per request
+    - trip: {"duration_days", "service_type", "data_needed_gb", "usage"}
+    - strategy: name of a registered scoring strategy
+
+  - returns the expected cost of each candidate as an array, lower is better
+
+score_plans_many()
+
+  - scores many trips of one zone against the same plan arrays, trips is a list of trip dicts
+  - returns a (trips, plans) array of costs, row i scores the plans for trips[i]
+
+strategies score all candidates of a request in one vectorized call and are registered by name
+
+    @register_scoring_strategy('my_strategy')
+    def my_strategy(plans: dict[str, np.ndarray], rates: dict, trip: dict) -> np.ndarray:
+        ...
+
+a strategy may also register a batch version that scores all trips in one array operation, the trip columns
+from trip_columns() have shape (trips, 1) and broadcast against the plan arrays. score_plans_many() stacks
+the single trip version for strategies without one
+
+    @register_batch_scoring_strategy('my_strategy')
+    def my_strategy_many(plans: dict[str, np.ndarray], rates: dict, trips: dict[str, np.ndarray]) -> np.ndarray:
+        ...
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+from typing import Callable, Optional
+import numpy as np
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+SERVICE_TYPES = [
+    'data',
+    'calls',
+    'sms'
+]
+SCORING_STRATEGY_DEFAULT = 'total_cost'
+# bumped when a built-in strategy changes, so that results precomputed with the old one are rebuilt
+SCORING_MODEL_VERSION = 2
+KB_PER_GB = 1000 * 1000
+DATA_RATE_UNIT_KB = 10
+USAGE_KEYS = [
+    'call_minutes_outgoing',
+    'call_minutes_incoming',
+    'sms'
+]
+DAILY_USAGE_PROFILES = {
+    'data': {'call_minutes_outgoing': 0, 'call_minutes_incoming': 0, 'sms': 0},
+    'calls': {'call_minutes_outgoing': 10, 'call_minutes_incoming': 10, 'sms': 0},
+    'sms': {'call_minutes_outgoing': 0, 'call_minutes_incoming': 0, 'sms': 5}
+}
+
+
+# module variables ---------------------------------------------------------------------------------------------------
+SCORING_STRATEGIES: dict[str, Callable] = {}
+BATCH_SCORING_STRATEGIES: dict[str, Callable] = {}
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def register_scoring_strategy(name: str) -> Callable:
+    """Decorator that registers a vectorized scoring strategy under the given name."""
+    def register(strategy: Callable) -> Callable:
+        SCORING_STRATEGIES[name] = strategy
+        return strategy
+    return register
+
+
+def register_batch_scoring_strategy(name: str) -> Callable:
+    """Decorator that registers the trips x plans version of the scoring strategy of the given name."""
+    def register(strategy: Callable) -> Callable:
+        BATCH_SCORING_STRATEGIES[name] = strategy
+        return strategy
+    return register
+
+
+def get_scoring_strategy(name: str) -> Callable:
+    if name not in SCORING_STRATEGIES:
+        msg = f'unknown scoring strategy: {name}. Registered {list(SCORING_STRATEGIES)}'
+        raise ValueError(msg)
+    return SCORING_STRATEGIES[name]
+
+
+def trip_usage(trip: dict) -> dict:
+    """Total call minutes and SMS for the trip, from the service type profile unless given in trip['usage']."""
+    usage = trip.get('usage') or {}
+    daily = DAILY_USAGE_PROFILES[trip['service_type']]
+    return {
+        k: usage[k] if usage.get(k) is not None else daily[k] * trip['duration_days']
+        for k in USAGE_KEYS
+    }
+
+
+def trip_columns(trips: list[dict]) -> dict[str, np.ndarray]:
+    """duration_days, data_needed_gb, 0 if not given, and the trip_usage() counts of the trips as (trips, 1) arrays."""
+    usages = [trip_usage(t) for t in trips]
+    columns = {
+        'duration_days': [t['duration_days'] for t in trips],
+        'data_needed_gb': [t.get('data_needed_gb') or 0.0 for t in trips],
+        **{k: [u[k] for u in usages] for k in USAGE_KEYS}
+    }
+    return {c: np.asarray(values, dtype=np.float64).reshape(-1, 1) for c, values in columns.items()}
+
+
+def plan_renewals(trip_days, plan_days) -> np.ndarray:
+    """Times a plan is bought to cover the trip, ceil(trip / plan) and at least once."""
+    return np.maximum(np.ceil(np.divide(trip_days, plan_days)), 1.0)
+
+
+def usage_cost(usage: dict, rates: dict) -> float:
+    """Pay-per-use cost of the trip_usage() call minutes and SMS, also for trip_columns() arrays."""
+    return (
+        usage['call_minutes_outgoing'] * (rates.get('rate_calls_outgoing_per_min') or 0.0)
+        + usage['call_minutes_incoming'] * (rates.get('rate_calls_incoming_per_min') or 0.0)
+        + usage['sms'] * (rates.get('rate_per_sms') or 0.0)
+    )
+
+
+def score_plans(plans: dict[str, np.ndarray], rates: dict, trip: dict,
+                strategy: Optional[str] = None) -> np.ndarray:
+    service = trip['service_type']
+    if service not in SERVICE_TYPES:
+        msg = f'unsupported service type: {service}. Allowed {SERVICE_TYPES}'
+        raise ValueError(msg)
+
+    scoring_strategy = get_scoring_strategy(strategy or SCORING_STRATEGY_DEFAULT)
+    return np.asarray(scoring_strategy(plans, rates, trip), dtype=np.float64)
+
+
+def score_plans_many(plans: dict[str, np.ndarray], rates: dict, trips: list[dict],
+                     strategy: Optional[str] = None) -> np.ndarray:
+    for trip in trips:
+        if trip['service_type'] not in SERVICE_TYPES:
+            msg = f"unsupported service type: {trip['service_type']}. Allowed {SERVICE_TYPES}"
+            raise ValueError(msg)
+
+    name = strategy or SCORING_STRATEGY_DEFAULT
+    scoring_strategy = get_scoring_strategy(name)
+    shape = (len(trips), len(plans['price_sgd']))
+    if not trips:
+        return np.empty(shape, dtype=np.float64)
+    batch_strategy = BATCH_SCORING_STRATEGIES.get(name)
+    if batch_strategy is None:
+        return np.vstack([
+            np.asarray(scoring_strategy(plans, rates, trip), dtype=np.float64) for trip in trips
+        ]).reshape(shape)
+    return np.broadcast_to(np.asarray(batch_strategy(plans, rates, trip_columns(trips)), dtype=np.float64), shape)
+
+
+# strategies ---------------------------------------------------------------------------------------------------------
+@register_scoring_strategy('total_cost')
+def total_trip_cost(plans: dict[str, np.ndarray], rates: dict, trip: dict) -> np.ndarray:
+    """Plan price plus data overage at the pay-per-use data rate plus call and SMS usage at pay-per-use rates.
+    A plan shorter than the trip is bought plan_renewals() times, with that many times its price and data."""
+    renewals = plan_renewals(trip['duration_days'], plans['duration_days'])
+    data_needed = trip.get('data_needed_gb') or 0.0
+    overage_gb = np.maximum(data_needed - plans['data_gb'] * renewals, 0.0)
+    overage_units = overage_gb * KB_PER_GB / DATA_RATE_UNIT_KB
+    data_cost = overage_units * (rates.get('rate_data_per_10kb') or 0.0)
+
+    return plans['price_sgd'] * renewals + data_cost + usage_cost(trip_usage(trip), rates)
+
+
+@register_batch_scoring_strategy('total_cost')
+def total_trip_cost_many(plans: dict[str, np.ndarray], rates: dict, trips: dict[str, np.ndarray]) -> np.ndarray:
+    renewals = plan_renewals(trips['duration_days'], plans['duration_days'])
+    overage_gb = np.maximum(trips['data_needed_gb'] - plans['data_gb'] * renewals, 0.0)
+    overage_units = overage_gb * KB_PER_GB / DATA_RATE_UNIT_KB
+    data_cost = overage_units * (rates.get('rate_data_per_10kb') or 0.0)
+
+    return plans['price_sgd'] * renewals + data_cost + usage_cost(trips, rates)
+
+
+@register_scoring_strategy('max_data')
+def max_data(plans: dict[str, np.ndarray], rates: dict, trip: dict) -> np.ndarray:
+    """Prefers the plan with the largest data allowance, regardless of price."""
+    return -plans['data_gb']
+
+
+@register_batch_scoring_strategy('max_data')
+def max_data_many(plans: dict[str, np.ndarray], rates: dict, trips: dict[str, np.ndarray]) -> np.ndarray:
+    return np.broadcast_to(-plans['data_gb'], (len(trips['duration_days']), len(plans['data_gb'])))
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""HTTP service for the roaming plan recommender, intent classifier and dialogue manager
+
+AgentService
+
+  - asyncio HTTP/1.1 server from the standard library, connections are kept alive between requests
+    until the client closes them, sends Connection: close or stays idle for keep_alive_seconds
+  - at most max_concurrency requests are handled at once, further requests wait for a slot
+  - recommend() runs on a thread pool of max_workers threads so that it does not block the event loop,
+    classify and dialogue steps await the async classifier interfaces
+  - JSON endpoints
+    - GET /health -> {"status": <ok | error>, "components": {<handler>: <BaseHandler.status()>}}, 503 on error
+    - GET /metrics -> instrumentation metrics in the Prometheus text format, see base.py
+    - POST /recommend {"destination", "duration_days", "service_type", "data_needed_gb", "usage"}
+      -> {"plans": <recommend() shortlist>}, 400 for fields of the wrong type, duration_days must be an integer,
+      data_needed_gb and the usage values numbers or null, 422 for lookup misses such as an unknown destination,
+      503 when the database is unavailable and 500 for other recommender faults
+    - POST /classify {"text"} -> {"reason", "score", "redirect"}
+    - POST /sessions -> {"session_id", "message": <welcome message>}
+    - POST /sessions/<session_id>/step {"text"} -> DialogueManager.astep() response, 404 for unknown sessions
+    - DELETE /sessions/<session_id> -> {"session_id"}
+    - sessions=False answers the session endpoints with 501
+
+PreforkServer
+
+  - the parent process loads the catalog snapshot, destination index and gazetteer once, closes its database
+    connections, opens the listening socket and forks the worker processes
+  - every worker serves AgentService on the inherited socket, the kernel spreads incoming connections across them
+  - the workers share the parent's loaded data copy-on-write, gc.freeze() before the fork keeps the garbage
+    collector from touching, and so copying, those pages
+  - sessions live in the memory of the worker that started them, and a later request of the session may reach
+    another worker, so the session endpoints are turned off and answer 501, POST /classify serves single turns
+  - the parent supervises the workers and forks a replacement for each one that dies,
+    SIGTERM or SIGINT stops the workers and the parent
+  - POSIX only, it needs os.fork()
+
+python http_agent.py [--host 127.0.0.1] [--port 8080] [--max-concurrency 64] [--workers 8] [--processes 4]
+"""
+# dependencies -------------------------------------------------------------------------------------------------------
+import asyncio
+import functools
+import gc
+import json
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Optional
+from base import METRICS, BaseHandler
+from .chat_agent import DialogueManager
+from .recommend import ERROR_DATABASE, ERROR_UNAVAILABLE, MISS_CODES, RoamingPlanRecommender
+
+
+# constants ----------------------------------------------------------------------------------------------------------
+HOST_DEFAULT = '127.0.0.1'
+PORT_DEFAULT = 8080
+MAX_CONCURRENCY_DEFAULT = 64
+MAX_WORKERS_DEFAULT = 8
+KEEP_ALIVE_SECONDS = 15.0
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+LISTEN_BACKLOG = 1024
+RESTART_DELAY_SECONDS = 1.0
+RECOMMEND_ARGS = ['destination', 'duration_days', 'service_type', 'data_needed_gb', 'usage']
+RECOMMEND_ARGS_REQUIRED = ['destination', 'duration_days']
+RECOMMEND_ARGS_TYPES = {
+    'destination': lambda v: isinstance(v, str),
+    'duration_days': lambda v: _is_number(v, integer=True),
+    'service_type': lambda v: isinstance(v, str),
+    'data_needed_gb': lambda v: _is_number(v, nullable=True),
+    'usage': lambda v: v is None or isinstance(v, dict)
+}
+
+
+# helper functions ---------------------------------------------------------------------------------------------------
+def _is_number(value, nullable=False, integer=False) -> bool:
+    if value is None:
+        return nullable
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) if integer else isinstance(value, (int, float))
+
+
+# classes ------------------------------------------------------------------------------------------------------------
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message=''):
+        self.status = status
+        self.message = message or status.phrase
+        super().__init__(self.message)
+
+
+class AgentService(BaseHandler):
+    def __init__(self, host=HOST_DEFAULT, port=PORT_DEFAULT, max_concurrency=None, max_workers=None,
+                 recommender: Optional[RoamingPlanRecommender] = None, manager: Optional[DialogueManager] = None,
+                 keep_alive_seconds=KEEP_ALIVE_SECONDS, sessions=True):
+        self.host: str = host
+        self.port: int = port
+        self.max_concurrency: int = max_concurrency or MAX_CONCURRENCY_DEFAULT
+        self.max_workers: int = max_workers or MAX_WORKERS_DEFAULT
+        self.keep_alive_seconds: float = keep_alive_seconds
+        self.sessions: bool = sessions
+        self.recommender = recommender or RoamingPlanRecommender(snapshot=True, read_only=True)
+        self.manager = manager or DialogueManager()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0
+        self._preloaded = False
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.host}:{self.port} [{self.status()}]>'
+
+    def exit(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def preload(self):
+        """Loads the catalog snapshot, destination index and gazetteer in the calling thread."""
+        self.recommender.source_connect()
+        self.recommender.destination_index_load()
+        self.manager.classifier.prefilter
+        self._preloaded = True
+
+    async def start(self, sock: Optional[socket.socket] = None):
+        """Loads the catalog and destination indexes unless preloaded, then listens on sock, or on host and port.
+        The bound port is set on self.port."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='recommend')
+        if not self._preloaded:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.preload)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if sock is not None:
+            self._server = await asyncio.start_server(self._connection_handle, sock=sock, limit=MAX_HEADER_BYTES)
+        else:
+            self._server = await asyncio.start_server(
+                self._connection_handle, self.host, self.port, limit=MAX_HEADER_BYTES
+            )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._status_code = 1
+
+    async def serve_forever(self, sock: Optional[socket.socket] = None):
+        if self._server is None:
+            await self.start(sock=sock)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._status_code = 0
+        self.exit()
+
+    async def _connection_handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_seconds)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    status = HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+                    await self._respond(writer, status, {'error': 'headers too large'})
+                    break
+
+                try:
+                    method, path, version, headers = self._request_parse(head)
+                    length = int(headers.get('content-length', 0) or 0)
+                except (ValueError, UnicodeDecodeError):
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'malformed request'})
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': 'body too large'})
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                async with self._semaphore:
+                    self.in_flight += 1
+                    try:
+                        status, payload = await self._dispatch(method, path, body)
+                    finally:
+                        self.in_flight -= 1
+                await self._respond(writer, status, payload, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    def _request_parse(head: bytes) -> tuple[str, str, str, dict[str, str]]:
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target.split('?', 1)[0], version, headers
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: HTTPStatus, payload, keep_alive=False):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        head = (
+            f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, object]:
+        parts = [p for p in path.split('/') if p]
+        route = '/'.join(parts[:1]) or 'root'
+        with self.span(route):
+            try:
+                if parts == ['health'] and method == 'GET':
+                    return self.health()
+                if parts == ['metrics'] and method == 'GET':
+                    return HTTPStatus.OK, METRICS.prometheus_text()
+                if parts == ['recommend'] and method == 'POST':
+                    return await self.recommend(self._json(body))
+                if parts == ['classify'] and method == 'POST':
+                    return await self.classify(self._json(body))
+                if parts == ['sessions'] and method == 'POST':
+                    return self.session_start()
+                if len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'step' and method == 'POST':
+                    return await self.step(parts[1], self._json(body))
+                if len(parts) == 2 and parts[0] == 'sessions' and method == 'DELETE':
+                    return self.session_end(parts[1])
+                if route in {'health', 'metrics', 'recommend', 'classify', 'sessions'}:
+                    raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+                raise HTTPError(HTTPStatus.NOT_FOUND)
+            except HTTPError as e:
+                return e.status, {'error': e.message}
+            except Exception as e:
+                self._exception_handle(msg=f'{method} {path} failed', exception=e, is_fatal=False)
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': self.error}
+
+    @staticmethod
+    def _json(body: bytes) -> dict:
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'request body is not valid JSON')
+        if not isinstance(payload, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'request body must be a JSON object')
+        return payload
+
+    @staticmethod
+    def _text(payload: dict) -> str:
+        text = payload.get('text')
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "'text' is required")
+        return text
+
+    def health(self) -> tuple[HTTPStatus, dict]:
+        components = {
+            'recommender': self._component_status(self.recommender),
+            'dialogue_manager': self._component_status(self.manager)
+        }
+        healthy = 'ERROR' not in components.values()
+        return (HTTPStatus.OK if healthy else HTTPStatus.SERVICE_UNAVAILABLE), {
+            'status': 'ok' if healthy else 'error',
+            'components': components,
+            'in_flight': self.in_flight,
+            'pid': os.getpid()
+        }
+
+    @staticmethod
+    def _component_status(handler: BaseHandler) -> str:
+        try:
+            return handler.status()
+        except Exception:
+            return 'ERROR'
+
+    async def recommend(self, payload: dict) -> tuple[HTTPStatus, dict]:
+        unknown = [k for k in payload if k not in RECOMMEND_ARGS]
+        missing = [k for k in RECOMMEND_ARGS_REQUIRED if k not in payload]
+        if unknown or missing:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f'unknown fields {unknown}, missing fields {missing}')
+        self._recommend_args_check(payload)
+        loop = asyncio.get_running_loop()
+        plans = await loop.run_in_executor(self.executor, functools.partial(self.recommender.recommend, **payload))
+        return self._recommend_status(plans), {'plans': plans}
+
+    @staticmethod
+    def _recommend_args_check(payload: dict):
+        invalid = [k for k, is_valid in RECOMMEND_ARGS_TYPES.items() if k in payload and not is_valid(payload[k])]
+        usage = payload.get('usage')
+        if isinstance(usage, dict):
+            invalid += [f'usage.{k}' for k, v in usage.items() if not _is_number(v, nullable=True)]
+        if invalid:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f'invalid fields {invalid}')
+
+    @staticmethod
+    def _recommend_status(plans: list[dict]) -> HTTPStatus:
+        if not plans or 'error' not in plans[0]:
+            return HTTPStatus.OK
+        code = plans[0].get('code')
+        if code in MISS_CODES:
+            return HTTPStatus.UNPROCESSABLE_ENTITY
+        if code in (ERROR_UNAVAILABLE, ERROR_DATABASE):
+            return HTTPStatus.SERVICE_UNAVAILABLE
+        return HTTPStatus.INTERNAL_SERVER_ERROR
+
+    async def classify(self, payload: dict) -> tuple[HTTPStatus, dict]:
+        text = self._text(payload)
+        try:
+            return HTTPStatus.OK, await self.manager.classifier.aclassify(text)
+        except Exception as e:
+            raise HTTPError(HTTPStatus.BAD_GATEWAY, f'classification failed: {e}')
+
+    def _sessions_check(self):
+        if not self.sessions:
+            raise HTTPError(
+                HTTPStatus.NOT_IMPLEMENTED, 'sessions are not available with pre-forked worker processes, '
+                'serve with one process'
+            )
+
+    def session_start(self) -> tuple[HTTPStatus, dict]:
+        self._sessions_check()
+        session = self.manager.session_start()
+        return HTTPStatus.CREATED, {'session_id': session['session_id'], 'message': self.manager.welcome_message}
+
+    async def step(self, session_id: str, payload: dict) -> tuple[HTTPStatus, dict]:
+        self._sessions_check()
+        text = self._text(payload)
+        if session_id not in self.manager.sessions:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f'unknown session {session_id}')
+        try:
+            return HTTPStatus.OK, await self.manager.astep(text, session_id=session_id)
+        except Exception as e:
+            raise HTTPError(HTTPStatus.BAD_GATEWAY, f'classification failed: {e}')
+
+    def session_end(self, session_id: str) -> tuple[HTTPStatus, dict]:
+        self._sessions_check()
+        if session_id not in self.manager.sessions:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f'unknown session {session_id}')
+        self.manager.session_end(session_id)
+        return HTTPStatus.OK, {'session_id': session_id}
+
+
+class PreforkServer(BaseHandler):
+    def __init__(self, host=HOST_DEFAULT, port=PORT_DEFAULT, processes=None, max_concurrency=None, max_workers=None):
+        self.host: str = host
+        self.port: int = port
+        self.processes: int = processes or os.cpu_count() or 1
+        self.service = AgentService(
+            host=host, port=port, max_concurrency=max_concurrency, max_workers=max_workers, sessions=False
+        )
+        self.workers: dict[int, float] = {}
+        self.restarts = 0
+        self._sock: Optional[socket.socket] = None
+        self._stopping = False
+        super().__init__()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self.workers)} workers on {self.host}:{self.port} [{self.status()}]>'
+
+    def exit(self):
+        self._stopping = True
+        self._workers_signal(signal.SIGTERM)
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def run(self):
+        """Loads the shared data, forks the workers and supervises them until SIGTERM or SIGINT."""
+        if not hasattr(os, 'fork'):
+            self._exception_handle(msg='pre-fork mode needs os.fork(), use processes=1 on this platform')
+            return
+        self.service.preload()
+        # sqlite connections must not cross a fork, the workers open their own on first use
+        self.service.recommender.db_close()
+        self._sock = socket.create_server((self.host, self.port), backlog=LISTEN_BACKLOG)
+        self.port = self._sock.getsockname()[1]
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop_signal)
+        signal.signal(signal.SIGINT, self._stop_signal)
+        for _ in range(self.processes):
+            self._worker_spawn()
+        self._status_code = 1
+        print(f'INFO. serving on http://{self.host}:{self.port} with {self.processes} workers', flush=True)
+        try:
+            self._supervise()
+        finally:
+            self.exit()
+            self._workers_reap()
+            self._status_code = 0
+
+    def _worker_spawn(self):
+        # stop signals stay blocked until the child has replaced the parent's handlers
+        stop_signals = {signal.SIGTERM, signal.SIGINT}
+        signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+                asyncio.run(self.service.serve_forever(sock=self._sock))
+            except BaseException:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+
+    def _supervise(self):
+        while not self._stopping:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            self._exception_handle(
+                msg=f'worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting', is_fatal=False
+            )
+            if time.monotonic() - started < RESTART_DELAY_SECONDS:
+                # a worker that dies right after start would otherwise be restarted in a tight loop
+                time.sleep(RESTART_DELAY_SECONDS)
+                if self._stopping:
+                    break
+            self.restarts += 1
+            self._worker_spawn()
+
+    def _stop_signal(self, signum, frame):
+        self._stopping = True
+        self._workers_signal(signal.SIGTERM)
+
+    def _workers_signal(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+    def _workers_reap(self):
+        for pid in list(self.workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            self.workers.pop(pid, None)
+
+
+# entry point --------------------------------------------------------------------------------------------------------
+def serve(host=HOST_DEFAULT, port=PORT_DEFAULT, max_concurrency=None, max_workers=None, processes=1):
+    if processes != 1:
+        PreforkServer(
+            host=host, port=port, processes=processes, max_concurrency=max_concurrency, max_workers=max_workers
+        ).run()
+        return
+
+    service = AgentService(host=host, port=port, max_concurrency=max_concurrency, max_workers=max_workers)
+
+    async def main():
+        await service.start()
+        print(f'INFO. serving on http://{service.host}:{service.port}')
+        await service.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.exit()